@@ -1,25 +1,37 @@
+import time
 from PyQt6.QtWidgets import (
     QWidget,
     QVBoxLayout,
     QHBoxLayout,
+    QCheckBox,
     QPushButton,
     QLineEdit,
     QLabel,
-    QFrame,
-    QScrollArea,
+    QListView,
+    QListWidget,
+    QListWidgetItem,
 )
 from PyQt6.QtGui import QFont
 from PyQt6.QtCore import Qt, QTimer
 import qtawesome as qta
 from pos import POSHandler
+from GUI.cart import CartDelegate, CartModel
+from GUI.stock import LowStockPanel, StockEvents
+from GUI.workers import get_task_queue
+from metrics import metrics
+from session import SESSION_PATH, CartSession
+
+# Rebuild the search index when a search starts and it is older than this
+SEARCH_REFRESH_SECONDS = 30
 
 
 class POSWidget(QWidget):
-    def __init__(self):
+    def __init__(self, pos_handler=None, session_path=SESSION_PATH):
         super().__init__()
 
         self.layout = QVBoxLayout(self)
-        self.pos_handler = POSHandler()
+        self.pos_handler = pos_handler or POSHandler()
+        self.task_queue = get_task_queue()
 
         self.scanner_input = QLineEdit(self)
         self.scanner_input.setPlaceholderText("Scan Barcode Here...")
@@ -35,24 +47,67 @@ class POSWidget(QWidget):
         )
         self.scanner_input.setFocus()
         self.scanner_input.returnPressed.connect(self.scan_item)
+
+        # Scans are numbered as they are typed and lookups run on the pool;
+        # results are applied to the cart strictly in scan order
+        self.pending_scans = {}
+        self.scan_results = {}
+        self.next_scan_seq = 0
+        self.next_apply_seq = 0
+        self.sale_requested = False
         self.layout.addWidget(self.scanner_input)
 
-        # Scroll Area for Items
-        self.scroll_area = QScrollArea(self)
-        self.scroll_area.setWidgetResizable(True)
-        self.scroll_area.setStyleSheet("border: none;")
-        self.list_container = QWidget()
-        self.list_container.setStyleSheet("background-color: white;")
-        self.scanned_items_list = QVBoxLayout(self.list_container)
-        self.scanned_items_list.setContentsMargins(0, 0, 0, 0)
-
-        self.scroll_area.setWidget(self.list_container)
-        self.scroll_area.setFixedHeight(300)
-        self.scroll_area.setVerticalScrollBarPolicy(
-            Qt.ScrollBarPolicy.ScrollBarAlwaysOn
+        # Manual entry for items without a barcode, e.g. meat by weight
+        self.search_index = None
+        self.search_index_loading = False
+        self.search_input = QLineEdit(self)
+        self.search_input.setPlaceholderText("Search Item Name...")
+        self.search_input.setStyleSheet(
+            """
+            font-size: 16px;
+            padding: 8px;
+            border: 2px solid #17a2b8;
+            border-radius: 5px;
+            background-color: #ffffff;
+            color: #333;
+        """
         )
-
-        self.layout.addWidget(self.scroll_area)
+        self.search_input.textChanged.connect(self.search_items)
+        self.search_input.returnPressed.connect(self.add_search_result)
+        self.layout.addWidget(self.search_input)
+
+        self.search_results = QListWidget(self)
+        self.search_results.setStyleSheet("font-size: 14px; background-color: white;")
+        self.search_results.setMaximumHeight(150)
+        self.search_results.itemActivated.connect(self.add_search_result)
+        self.search_results.hide()
+        self.layout.addWidget(self.search_results)
+
+        # Cart lines are painted by a delegate, so only visible rows cost anything
+        self.scanned_items = CartModel(self, self.open_session(session_path))
+        self.scanned_items.total_changed.connect(self.update_total_price)
+        self.cart_view = QListView(self)
+        self.cart_view.setModel(self.scanned_items)
+        self.cart_view.setItemDelegate(CartDelegate(self.cart_view))
+        self.cart_view.setUniformItemSizes(True)
+        self.cart_view.setSelectionMode(QListView.SelectionMode.NoSelection)
+        self.cart_view.setFocusPolicy(Qt.FocusPolicy.NoFocus)
+        self.cart_view.setStyleSheet("border: none; background-color: white;")
+        self.cart_view.setFixedHeight(300)
+        self.cart_view.setVerticalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOn)
+        self.layout.addWidget(self.cart_view)
+
+        # One line for the latest error instead of a label per error
+        self.status_label = QLabel("", self)
+        self.status_label.setStyleSheet("color: red; font-size: 14px;")
+        self.layout.addWidget(self.status_label)
+
+        # Stock changes are pushed by the storage layer, never polled
+        self.low_stock_panel = LowStockPanel(self)
+        self.layout.addWidget(self.low_stock_panel)
+        self.stock_events = StockEvents(self)
+        self.stock_events.changed.connect(self.on_stock_changed)
+        self.pos_handler.subscribe_stock(self.stock_events.changed.emit)
 
         self.total_price_label = QLabel("Total: 0.00 KRW", self)
         self.total_price_label.setFont(QFont("Arial", 16))
@@ -63,14 +118,25 @@ class POSWidget(QWidget):
         self.total_price_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
         self.layout.addWidget(self.total_price_label)
 
+        # Wholesale orders go to the business ledger under a customer name
+        business_layout = QHBoxLayout()
+        self.business_checkbox = QCheckBox("Business sale", self)
+        self.business_checkbox.setStyleSheet("font-size: 14px;")
+        self.business_checkbox.toggled.connect(self.toggle_business_sale)
+        business_layout.addWidget(self.business_checkbox)
+        self.customer_input = QLineEdit(self)
+        self.customer_input.setPlaceholderText("Customer name...")
+        self.customer_input.setStyleSheet("font-size: 14px; padding: 6px;")
+        self.customer_input.hide()
+        business_layout.addWidget(self.customer_input)
+        self.layout.addLayout(business_layout)
+
         self.sell_button = QPushButton(" Sell", self)
         self.sell_button.setObjectName("sellButton")
         self.sell_button.setIcon(qta.icon("fa5s.money-bill-wave"))
         self.sell_button.clicked.connect(self.process_sale)
         self.layout.addWidget(self.sell_button)
 
-        self.scanned_items = {}
-
         self.setStyleSheet(
             """
             QPushButton#sellButton {
@@ -89,135 +155,267 @@ class POSWidget(QWidget):
             """
         )
 
+        restored, submitted = self.scanned_items.restore()
+        if submitted:
+            self.show_error(
+                f"Restored {restored} cart lines from the last session; "
+                f"{submitted} were in a sale that may not have been saved"
+            )
+        elif restored:
+            self.show_error(f"Restored {restored} cart lines from the last session")
+
+    def open_session(self, session_path):
+        """Open the crash-safe cart file; the till still works without it."""
+        if not session_path:
+            return None
+        try:
+            return CartSession(session_path)
+        except (OSError, ValueError) as e:
+            print(f"Error opening cart session: {e}")
+            return None
+
     def focus_barcode_input(self):
         self.scanner_input.setFocus()
 
     def scan_item(self):
+        """Take the scanned barcode off the input at once and look it up later.
+
+        The input is free for the next scan before the lookup even starts, so
+        a scanner burst is never merged into one line or lost.
+        """
         barcode = self.scanner_input.text().strip()
+        self.scanner_input.clear()
         if not barcode:
             return
 
-        item = self.pos_handler.find_item_by_barcode(barcode)
-        if item:
-            item_name = item["Item Name"]
-            sale_price = float(item["Sale Price"])
-
-            if item_name in self.scanned_items:
-                self.scanned_items[item_name]["quantity"] += 1
-                self.scanned_items[item_name]["quantity_label"].setText(
-                    f"{self.scanned_items[item_name]['quantity']}"
-                )
-            else:
-                item_widget = self.create_item_widget(item_name, sale_price)
-                self.scanned_items_list.addWidget(item_widget)
-
-                self.scanned_items[item_name] = {
-                    "quantity": 1,
-                    "price": sale_price,
-                    "widget": item_widget,
-                    "quantity_label": item_widget.findChild(
-                        QLabel, f"quantity_{item_name}"
-                    ),
-                }
-
-            self.update_total_price()
-        else:
-            error_label = QLabel("Product not found", self)
-            error_label.setStyleSheet("color: red; font-size: 14px;")
-            self.scanned_items_list.addWidget(error_label)
-
-        self.scanner_input.clear()
-
-    def create_item_widget(self, item_name, sale_price):
-        item_frame = QFrame()
-        item_frame.setFixedHeight(50)
-        item_frame.setStyleSheet(
-            """
-            background-color: #f8f9fa;
-            color: #333;
-            border: 1px solid #ccc;
-            border-radius: 5px;
-            padding: 5px;
-        """
+        seq = self.next_scan_seq
+        self.next_scan_seq += 1
+        self.pending_scans[seq] = (barcode, time.perf_counter())
+        self.task_queue.submit_read(
+            self.pos_handler.find_item_by_barcode,
+            barcode,
+            on_success=lambda item: self.on_scan_resolved(seq, item),
+            on_error=lambda message: self.on_scan_resolved(seq, None, message),
         )
 
-        item_layout = QHBoxLayout(item_frame)
-        item_layout.setContentsMargins(5, 5, 5, 5)
-        item_layout.setSpacing(10)
-
-        name_label = QLabel(f"{item_name} - {sale_price:.2f} KRW", self)
-        name_label.setFont(QFont("Arial", 12))
+    def on_scan_resolved(self, seq, item, error=None):
+        if seq < self.next_apply_seq:
+            return  # The cart was cleared while this lookup ran
+        self.scan_results[seq] = (item, error)
+        while self.next_apply_seq in self.scan_results:
+            seq = self.next_apply_seq
+            item, error = self.scan_results.pop(seq)
+            barcode, scanned_at = self.pending_scans.pop(seq)
+            # Move on first, so one bad result cannot hold up later scans
+            self.next_apply_seq += 1
+            self.add_scanned_item(barcode, item, error)
+            metrics.record(
+                "pos.scan_to_cart", (time.perf_counter() - scanned_at) * 1000
+            )
+
+        if self.sale_requested and not self.pending_scans:
+            self.sale_requested = False
+            self.process_sale()
+
+    def add_scanned_item(self, barcode, item, error=None):
+        if error:
+            self.show_error(f"Lookup failed for {barcode}: {error}")
+        elif item:
+            self.add_to_cart(barcode, item)
+        else:
+            self.show_error("Product not found")
+
+    def add_to_cart(self, barcode, item):
+        """Put an item in the cart; returns False if it has no sale price."""
+        try:
+            price = float(item["Sale Price"])
+        except (TypeError, ValueError):
+            self.show_error(f"{item['Item Name'] or barcode} has no sale price")
+            return False
+        self.scanned_items.add_item(
+            barcode, item["Item Name"], price, left=item.get("Inventory Quantity")
+        )
+        self.show_error("")
+        return True
+
+    def drop_pending_scans(self):
+        """Forget lookups still in flight; their results are ignored."""
+        self.pending_scans.clear()
+        self.scan_results.clear()
+        self.next_apply_seq = self.next_scan_seq
+        self.sale_requested = False
+
+    def show_error(self, message):
+        self.status_label.setText(message)
+
+    def refresh_search_index(self):
+        """Build the search index from the inventory on a worker thread."""
+        if self.search_index_loading:
+            return
+        self.search_index_loading = True
+        self.task_queue.submit_read(
+            self.build_search_index,
+            on_success=self.on_search_index_built,
+            on_error=self.on_search_index_failed,
+        )
 
-        decrease_button = QPushButton("-", self)
-        decrease_button.setFixedSize(30, 30)
-        decrease_button.setStyleSheet(
-            "background-color: #dc3545; color: white; font-size: 14px; border-radius: 3px;"
+    def build_search_index(self):
+        from search import ItemSearchIndex
+
+        return ItemSearchIndex(self.pos_handler.get_items())
+
+    def on_search_index_built(self, search_index):
+        self.search_index_loading = False
+        self.search_index = search_index
+        # Events keep the panel current after this first fill
+        if not self.low_stock_panel.loaded:
+            self.low_stock_panel.load(search_index.items)
+        self.search_items(self.search_input.text())
+
+    def refresh_discounts(self):
+        """Pick up changes to the discount sheet without blocking the till."""
+        self.task_queue.submit_read(
+            self.pos_handler.get_discounts,
+            on_success=self.scanned_items.set_discounts,
+            on_error=lambda message: print(f"Error loading discounts: {message}"),
         )
-        decrease_button.clicked.connect(lambda: self.change_quantity(item_name, -1))
 
-        quantity_label = QLabel("1", self, objectName=f"quantity_{item_name}")
-        quantity_label.setFont(QFont("Arial", 12))
-        quantity_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
-        quantity_label.setFixedWidth(30)
+    def on_search_index_failed(self, message):
+        self.search_index_loading = False
+        self.show_error(f"Search is unavailable: {message}")
 
-        increase_button = QPushButton("+", self)
-        increase_button.setFixedSize(30, 30)
-        increase_button.setStyleSheet(
-            "background-color: #28a745; color: white; font-size: 14px; border-radius: 3px;"
-        )
-        increase_button.clicked.connect(lambda: self.change_quantity(item_name, 1))
-
-        item_layout.addWidget(name_label)
-        item_layout.addStretch()
-        item_layout.addWidget(decrease_button)
-        item_layout.addWidget(quantity_label)
-        item_layout.addWidget(increase_button)
-
-        return item_frame
-
-    def change_quantity(self, item_name, change):
-        if item_name in self.scanned_items:
-            self.scanned_items[item_name]["quantity"] += change
-            if self.scanned_items[item_name]["quantity"] <= 0:
-                self.remove_item(item_name)
-            else:
-                self.scanned_items[item_name]["quantity_label"].setText(
-                    f"{self.scanned_items[item_name]['quantity']}"
-                )
-            self.update_total_price()
-
-    def remove_item(self, item_name):
-        item_widget = self.scanned_items[item_name]["widget"]
-        self.scanned_items_list.removeWidget(item_widget)
-        item_widget.deleteLater()
-        del self.scanned_items[item_name]
-
-    def update_total_price(self):
-        self.total_price = sum(
-            item["quantity"] * item["price"] for item in self.scanned_items.values()
-        )
+    def search_items(self, text):
+        """Show ranked matches for the search box on every keystroke."""
+        self.search_results.clear()
+        if not text.strip():
+            self.search_results.hide()
+            return
+        if (
+            self.search_index is None
+            or time.monotonic() - self.search_index.built_at > SEARCH_REFRESH_SECONDS
+        ):
+            # Keep answering from the old index while a fresh one is built
+            self.refresh_search_index()
+        if self.search_index is None:
+            return
+
+        for item in self.search_index.search(text):
+            row = QListWidgetItem(
+                f"{item['Item Name']} - {float(item['Sale Price'] or 0):.2f} KRW"
+                f"  ({item['Barcode']})"
+            )
+            row.setData(Qt.ItemDataRole.UserRole, item)
+            self.search_results.addItem(row)
+        self.search_results.setVisible(self.search_results.count() > 0)
+        if self.search_results.count():
+            self.search_results.setCurrentRow(0)
+
+    def add_search_result(self, row=None):
+        """Put the chosen (or top) search result in the cart."""
+        if not isinstance(row, QListWidgetItem):
+            row = self.search_results.currentItem()
+        if row is None:
+            return
+        item = row.data(Qt.ItemDataRole.UserRole)
+        if self.add_to_cart(str(item["Barcode"]), item):
+            self.search_input.clear()
+            self.focus_barcode_input()
+
+    def on_stock_changed(self, changes):
+        self.scanned_items.set_stock(changes)
+        self.low_stock_panel.update_stock(changes)
+
+    def change_quantity(self, barcode, change):
+        row = self.scanned_items.rows.get(barcode)
+        if row is not None:
+            self.scanned_items.change_quantity(row, change)
+
+    def update_total_price(self, total):
+        self.total_price = total
         self.total_price_label.setText(f"Total: {self.total_price:.2f} KRW")
 
     def process_sale(self):
+        if self.pending_scans:
+            # Sell once the scans typed before the click are in the cart
+            self.sale_requested = True
+            return
         if not self.scanned_items:
-            error_label = QLabel("No items to sell. Add items first!", self)
-            error_label.setStyleSheet("color: red; font-size: 14px;")
-            self.scanned_items_list.addWidget(error_label)
+            self.show_error("No items to sell. Add items first!")
             return
 
-        for item_name, item_data in self.scanned_items.items():
-            for _ in range(item_data["quantity"]):
-                self.pos_handler.update_inventory(item_name)
+        cart = self.scanned_items.get_cart()
+        discounts = self.scanned_items.get_discounts()
+        if self.business_checkbox.isChecked():
+            self.process_business_sale(cart, discounts)
+            return
+        # The cart is cleared right away; the write is queued behind earlier
+        # sales, and a copy of the lines goes back in if it fails. The
+        # session keeps the lines until the sale is journaled
+        lines = self.scanned_items.get_lines()
+        slots = self.scanned_items.submit()
+        self.clear_inputs()
+        self.task_queue.submit_write(
+            self.pos_handler.record_sale,
+            cart,
+            discounts,
+            on_success=lambda result: self.on_sale_recorded(result, slots),
+            on_error=lambda message: self.on_sale_failed(message, lines, slots),
+        )
+        self.focus_barcode_input()
+        # Edits to the discount sheet apply from the next customer
+        self.refresh_discounts()
 
+    def toggle_business_sale(self, checked):
+        self.customer_input.setVisible(checked)
+        if checked:
+            self.customer_input.setFocus()
+        else:
+            self.customer_input.clear()
+            self.focus_barcode_input()
+
+    def process_business_sale(self, cart, discounts):
+        """Record a wholesale order; the cart stays until it is accepted."""
+        customer = self.customer_input.text().strip()
+        if not customer:
+            self.show_error("Enter the customer's name for a business sale.")
+            self.customer_input.setFocus()
+            return
+        self.sell_button.setEnabled(False)
+        self.task_queue.submit_write(
+            self.pos_handler.record_business_sale,
+            cart,
+            customer,
+            discounts,
+            on_success=self.on_business_sale_recorded,
+            on_error=self.on_business_sale_failed,
+        )
+
+    def on_business_sale_recorded(self, result):
+        self.sell_button.setEnabled(True)
         self.clear_inputs()
+        self.business_checkbox.setChecked(False)
+        self.refresh_discounts()
+        self.on_sale_recorded(result)
+
+    def on_business_sale_failed(self, message):
+        self.sell_button.setEnabled(True)
+        self.show_error(f"Business sale was not saved: {message}")
 
+    def on_sale_recorded(self, _result, slots=()):
+        self.scanned_items.release(slots)
         self.sell_button.setText("Success!")
         self.sell_button.setIcon(qta.icon("fa5s.check-circle"))
         self.sell_button.setProperty("success", True)
         self.style().polish(self.sell_button)
 
         QTimer.singleShot(2000, self.reset_sell_button)
-        self.focus_barcode_input()
+
+    def on_sale_failed(self, message, lines, slots):
+        self.scanned_items.put_back(lines)
+        self.scanned_items.release(slots)
+        self.show_error(
+            f"Sale was not saved, its items are back in the cart: {message}"
+        )
 
     def reset_sell_button(self):
         self.sell_button.setText(" Sell")
@@ -226,10 +424,8 @@ class POSWidget(QWidget):
         self.style().polish(self.sell_button)
 
     def clear_inputs(self):
+        self.drop_pending_scans()
         self.scanner_input.clear()
-        while self.scanned_items_list.count():
-            widget = self.scanned_items_list.takeAt(0).widget()
-            if widget:
-                widget.deleteLater()
+        self.search_input.clear()
         self.scanned_items.clear()
-        self.total_price_label.setText("Total: 0.00 KRW")
+        self.show_error("")
@@ -0,0 +1,281 @@
+from PyQt6.QtWidgets import QStyledItemDelegate
+from PyQt6.QtGui import QColor, QFont, QPen
+from PyQt6.QtCore import (
+    Qt,
+    QAbstractListModel,
+    QEvent,
+    QModelIndex,
+    QRect,
+    QSize,
+    pyqtSignal,
+)
+from discounts import CartPricer, DiscountTable
+
+QuantityRole = Qt.ItemDataRole.UserRole + 1
+PriceRole = Qt.ItemDataRole.UserRole + 2
+BarcodeRole = Qt.ItemDataRole.UserRole + 3
+
+ROW_HEIGHT = 50
+BUTTON_SIZE = 30
+
+
+class CartModel(QAbstractListModel):
+    """Cart lines for the POS view, one row per barcode."""
+
+    # Emitted with the new total whenever a quantity changes
+    total_changed = pyqtSignal(float)
+
+    def __init__(self, parent=None, session=None):
+        super().__init__(parent)
+        # Optional CartSession that mirrors every change to disk
+        self.session = session
+        self.lines = []
+        # barcode -> row
+        self.rows = {}
+        # Keeps the discounted total up to date line by line
+        self.pricer = CartPricer()
+        self.total = 0.0
+        # barcode -> stock on record, shown as "Left: N"
+        self.stock = {}
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.lines)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        line = self.lines[index.row()]
+        if role == Qt.ItemDataRole.DisplayRole:
+            text = f"{line['name']} - {line['price']:.2f} KRW"
+            label = self.pricer.line_label(line["barcode"])
+            if label:
+                text = f"{text} ({label})"
+            left = self.stock.get(line["barcode"])
+            return text if left is None else f"{text}  Left: {left}"
+        if role == QuantityRole:
+            return line["quantity"]
+        if role == PriceRole:
+            return line["price"]
+        if role == BarcodeRole:
+            return line["barcode"]
+        return None
+
+    def __contains__(self, barcode):
+        return barcode in self.rows
+
+    def __len__(self):
+        return len(self.lines)
+
+    def add_item(self, barcode, item_name, price, quantity=1, left=None):
+        """Add a new line, or bump the quantity of the existing one.
+
+        left is the item's stock on record, if known.
+        """
+        if left is not None:
+            self.stock[barcode] = left
+        row = self.rows.get(barcode)
+        if row is not None:
+            self.change_quantity(row, quantity)
+            return
+
+        row = len(self.lines)
+        self.beginInsertRows(QModelIndex(), row, row)
+        self.lines.append(
+            {
+                "name": item_name,
+                "barcode": barcode,
+                "price": price,
+                "quantity": quantity,
+            }
+        )
+        self.rows[barcode] = row
+        self.endInsertRows()
+        if self.session:
+            self.session.put_line(barcode, item_name, price, quantity)
+        self.set_total(self.pricer.set_line(barcode, price, quantity))
+        self.refresh_promotions(barcode)
+
+    def change_quantity(self, row, change):
+        """Change one line's quantity; the line goes away when it reaches 0."""
+        line = self.lines[row]
+        old_quantity = line["quantity"]
+        new_quantity = max(0, old_quantity + change)
+        if self.session:
+            self.session.set_quantity(line["barcode"], new_quantity)
+        if new_quantity == 0:
+            self.remove_row(row)
+        else:
+            line["quantity"] = new_quantity
+            index = self.index(row)
+            self.dataChanged.emit(index, index, [QuantityRole])
+        self.set_total(
+            self.pricer.set_line(line["barcode"], line["price"], new_quantity)
+        )
+        self.refresh_promotions(line["barcode"])
+
+    def refresh_promotions(self, barcode):
+        """Repaint the lines that share a mixed multi-buy with barcode."""
+        table = self.pricer.table
+        for group_id in table.groups_by_barcode.get(barcode, ()):
+            for other in self.pricer.group_lines.get(group_id, ()):
+                index = self.index(self.rows[other])
+                self.dataChanged.emit(index, index, [Qt.ItemDataRole.DisplayRole])
+
+    def set_discounts(self, discounts):
+        """Load rules from POSHandler.get_discounts() and reprice the cart."""
+        self.pricer = CartPricer(
+            DiscountTable(discounts["rules"], discounts["categories"])
+        )
+        for line in self.lines:
+            self.pricer.set_line(line["barcode"], line["price"], line["quantity"])
+        if self.lines:
+            self.dataChanged.emit(self.index(0), self.index(len(self.lines) - 1))
+        self.set_total(self.pricer.total)
+
+    def set_stock(self, changes):
+        """Update "Left" on the cart lines whose stock changed."""
+        for barcode, left in changes.items():
+            row = self.rows.get(barcode)
+            if row is None:
+                continue
+            self.stock[barcode] = left
+            index = self.index(row)
+            self.dataChanged.emit(index, index, [Qt.ItemDataRole.DisplayRole])
+
+    def remove_row(self, row):
+        self.beginRemoveRows(QModelIndex(), row, row)
+        line = self.lines.pop(row)
+        del self.rows[line["barcode"]]
+        self.stock.pop(line["barcode"], None)
+        for later in self.lines[row:]:
+            self.rows[later["barcode"]] -= 1
+        self.endRemoveRows()
+
+    def clear(self):
+        self.beginResetModel()
+        self.lines = []
+        self.rows = {}
+        self.stock = {}
+        self.pricer.clear()
+        if self.session:
+            self.session.clear()
+        self.endResetModel()
+        self.set_total(0.0)
+
+    def submit(self):
+        """Empty the cart for a queued sale; returns its session slots.
+
+        The lines stay in the session file until release() is given the
+        slots, once the sale is recorded or has failed.
+        """
+        slots = self.session.submit() if self.session else []
+        self.clear()
+        return slots
+
+    def release(self, slots):
+        if self.session:
+            self.session.release(slots)
+
+    def set_total(self, total):
+        # Recompute when the cart empties so float drift never shows
+        self.total = total if self.lines else 0.0
+        self.total_changed.emit(self.total)
+
+    def restore(self):
+        """Reload the cart left in the session file.
+
+        Returns the line count and how many of them were in a sale that may
+        not have been recorded.
+        """
+        if not self.session:
+            return 0, 0
+        lines = self.session.load()
+        for line in lines:
+            self.add_item(
+                line["barcode"], line["name"], line["price"], line["quantity"]
+            )
+        return len(lines), sum(line["submitted"] for line in lines)
+
+    def get_lines(self):
+        """Copies of the lines with their stock, for put_back()."""
+        return [dict(line, left=self.stock.get(line["barcode"])) for line in self.lines]
+
+    def put_back(self, lines):
+        """Add lines from get_lines() back to the cart, e.g. after a failed sale."""
+        for line in lines:
+            self.add_item(
+                line["barcode"],
+                line["name"],
+                line["price"],
+                line["quantity"],
+                left=line["left"],
+            )
+
+    def get_cart(self):
+        """Return the cart as {barcode: quantity}."""
+        return {line["barcode"]: line["quantity"] for line in self.lines}
+
+    def get_discounts(self):
+        """Return the discount on each line as {barcode: amount}."""
+        return self.pricer.get_discounts()
+
+
+class CartDelegate(QStyledItemDelegate):
+    """Paints a cart line with -/quantity/+ controls instead of child widgets."""
+
+    def sizeHint(self, option, index):
+        return QSize(option.rect.width(), ROW_HEIGHT)
+
+    def button_rects(self, rect):
+        """Rects of the -, quantity and + areas at the right of a row."""
+        top = rect.top() + (rect.height() - BUTTON_SIZE) // 2
+        plus = QRect(rect.right() - 10 - BUTTON_SIZE, top, BUTTON_SIZE, BUTTON_SIZE)
+        quantity = plus.translated(-BUTTON_SIZE - 10, 0)
+        minus = quantity.translated(-BUTTON_SIZE - 10, 0)
+        return minus, quantity, plus
+
+    def paint(self, painter, option, index):
+        painter.save()
+        rect = option.rect.adjusted(2, 2, -2, -2)
+        painter.setPen(QPen(QColor("#cccccc")))
+        painter.setBrush(QColor("#f8f9fa"))
+        painter.drawRoundedRect(rect, 5, 5)
+
+        minus, quantity, plus = self.button_rects(rect)
+        painter.setFont(QFont("Arial", 12))
+        painter.setPen(QColor("#333333"))
+        name_rect = rect.adjusted(10, 0, 0, 0)
+        name_rect.setRight(minus.left() - 10)
+        painter.drawText(
+            name_rect,
+            Qt.AlignmentFlag.AlignVCenter | Qt.AlignmentFlag.AlignLeft,
+            index.data(Qt.ItemDataRole.DisplayRole),
+        )
+        painter.drawText(
+            quantity, Qt.AlignmentFlag.AlignCenter, str(index.data(QuantityRole))
+        )
+
+        painter.setFont(QFont("Arial", 14))
+        for button, color, text in (
+            (minus, "#dc3545", "-"),
+            (plus, "#28a745", "+"),
+        ):
+            painter.setPen(Qt.PenStyle.NoPen)
+            painter.setBrush(QColor(color))
+            painter.drawRoundedRect(button, 3, 3)
+            painter.setPen(QColor("white"))
+            painter.drawText(button, Qt.AlignmentFlag.AlignCenter, text)
+        painter.restore()
+
+    def editorEvent(self, event, model, option, index):
+        if event.type() != QEvent.Type.MouseButtonRelease:
+            return False
+        minus, _quantity, plus = self.button_rects(option.rect.adjusted(2, 2, -2, -2))
+        pos = event.position().toPoint()
+        if minus.contains(pos):
+            model.change_quantity(index.row(), -1)
+            return True
+        if plus.contains(pos):
+            model.change_quantity(index.row(), 1)
+            return True
+        return False
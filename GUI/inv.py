@@ -7,16 +7,19 @@ from PyQt6.QtWidgets import (
     QLineEdit,
     QLabel,
     QApplication,
+    QFileDialog,
 )
 from inventory import InventoryHandler
+from GUI.workers import get_task_queue
 
 
 class InventoryWidget(QWidget):
-    def __init__(self):
+    def __init__(self, inventory_handler=None):
         super().__init__()
 
         self.layout = QVBoxLayout(self)
-        self.inventory_handler = InventoryHandler()
+        self.inventory_handler = inventory_handler or InventoryHandler()
+        self.task_queue = get_task_queue()
 
         input_style = """
             padding: 15px;
@@ -78,6 +81,15 @@ class InventoryWidget(QWidget):
         self.add_inventory_button.clicked.connect(self.add_inventory_item)
         self.layout.addWidget(self.add_inventory_button)
 
+        # Bulk import of a supplier delivery spreadsheet
+        self.import_button = QPushButton("Import Delivery", self)
+        self.import_button.setIcon(qta.icon("fa5s.file-import"))
+        self.import_button.setStyleSheet(
+            "background-color: #17a2b8; color: white; padding: 12px; font-size: 16px; border-radius: 5px; border: none;"
+        )
+        self.import_button.clicked.connect(self.import_delivery)
+        self.layout.addWidget(self.import_button)
+
         # Success message label
         self.success_message_label = QLabel("", self)
         self.success_message_label.setStyleSheet("color: green; font-size: 14px;")
@@ -104,33 +116,74 @@ class InventoryWidget(QWidget):
         return QApplication.keyboardModifiers() == Qt.KeyboardModifier.ShiftModifier
 
     def add_inventory_item(self):
-        try:
-            # Call the inventory handler to add or update the item
-            self.inventory_handler.add_inventory_item(
-                str(self.barcode_input.text()),
-                self.item_name_input.text(),
-                self.original_price_input.text(),
-                self.sale_price_input.text(),
-                self.inventory_quantity_input.text(),
-            )
+        # Call the inventory handler to add or update the item off the GUI thread
+        self.task_queue.submit_write(
+            self.inventory_handler.add_inventory_item,
+            str(self.barcode_input.text()),
+            self.item_name_input.text(),
+            self.original_price_input.text(),
+            self.sale_price_input.text(),
+            self.inventory_quantity_input.text(),
+            on_success=self.on_item_added,
+            on_error=self.show_error,
+        )
 
-            # Show success message
-            self.success_message_label.setText("Item added/updated successfully!")
-            self.success_message_label.setStyleSheet("color: green; font-size: 14px;")
+    def on_item_added(self, _result):
+        # Show success message
+        self.success_message_label.setText("Item added/updated successfully!")
+        self.success_message_label.setStyleSheet("color: green; font-size: 14px;")
 
-            # Change button text to "Added"
-            self.add_inventory_button.setText("Added")
+        # Change button text to "Added"
+        self.add_inventory_button.setText("Added")
 
-            # Set a timer to revert button text after 2 seconds
-            QTimer.singleShot(2000, self.reset_add_button)
+        # Set a timer to revert button text after 2 seconds
+        QTimer.singleShot(2000, self.reset_add_button)
 
-            # Clear input fields and focus barcode input for next scan
-            self.clear_inputs()
-            self.focus_barcode_input()
+        # Clear input fields and focus barcode input for next scan
+        self.clear_inputs()
+        self.focus_barcode_input()
 
-        except Exception as e:
-            self.success_message_label.setText(f"Error: {str(e)}")
-            self.success_message_label.setStyleSheet("color: red; font-size: 14px;")
+    def show_error(self, message):
+        self.success_message_label.setText(f"Error: {message}")
+        self.success_message_label.setStyleSheet("color: red; font-size: 14px;")
+
+    def import_delivery(self):
+        """Pick a supplier spreadsheet and merge it into the inventory."""
+        path, _ = QFileDialog.getOpenFileName(
+            self,
+            "Import Delivery",
+            "data",
+            "Spreadsheets (*.xlsx *.xls *.csv)",
+        )
+        if not path:
+            return
+
+        self.import_button.setEnabled(False)
+        self.success_message_label.setText("Importing...")
+        self.success_message_label.setStyleSheet("color: #333; font-size: 14px;")
+        self.task_queue.submit_write(
+            self.inventory_handler.import_items,
+            path,
+            on_success=self.on_delivery_imported,
+            on_error=self.on_delivery_failed,
+        )
+
+    def on_delivery_imported(self, result):
+        imported, rejected = result
+        self.import_button.setEnabled(True)
+        message = f"Imported {imported} items, rejected {len(rejected)} rows."
+        # Show the first few rejected rows; the rest are printed
+        for row in rejected[:3]:
+            message += f"\nRow {row['row']}: {row['reason']}"
+        for row in rejected:
+            print(f"Rejected row {row['row']} ({row['barcode']}): {row['reason']}")
+        self.success_message_label.setText(message)
+        color = "red" if rejected else "green"
+        self.success_message_label.setStyleSheet(f"color: {color}; font-size: 14px;")
+
+    def on_delivery_failed(self, message):
+        self.import_button.setEnabled(True)
+        self.show_error(message)
 
     def reset_add_button(self):
         """Revert button text to 'Add New Item'."""
@@ -140,23 +193,31 @@ class InventoryWidget(QWidget):
         """Prefill input fields if the barcode exists in the inventory."""
         barcode = self.barcode_input.text()
         if barcode:
-            item = self.inventory_handler.get_inventory_item(barcode)
-            if item:
-                self.item_name_input.setText(item.get("Item Name", ""))
-                self.original_price_input.setText(str(item.get("Original Price", "")))
-                self.sale_price_input.setText(str(item.get("Sale Price", "")))
-                self.inventory_quantity_input.setText(
-                    str(item.get("Inventory Quantity", ""))
-                )
-                self.success_message_label.setText(
-                    "Item found. Fields prefilled for editing."
-                )
-                self.success_message_label.setStyleSheet(
-                    "color: green; font-size: 14px;"
-                )
-            else:
-                self.success_message_label.setText("Item not found in inventory.")
-                self.success_message_label.setStyleSheet("color: red; font-size: 14px;")
+            self.task_queue.submit_read(
+                self.inventory_handler.get_inventory_item,
+                barcode,
+                on_success=lambda item: self.on_item_loaded(barcode, item),
+                on_error=self.show_error,
+            )
+
+    def on_item_loaded(self, barcode, item):
+        """Fill the fields once the lookup finishes, unless the barcode changed."""
+        if self.barcode_input.text() != barcode:
+            return
+        if item:
+            self.item_name_input.setText(item.get("Item Name") or "")
+            self.original_price_input.setText(str(item.get("Original Price", "")))
+            self.sale_price_input.setText(str(item.get("Sale Price", "")))
+            self.inventory_quantity_input.setText(
+                str(item.get("Inventory Quantity", ""))
+            )
+            self.success_message_label.setText(
+                "Item found. Fields prefilled for editing."
+            )
+            self.success_message_label.setStyleSheet("color: green; font-size: 14px;")
+        else:
+            self.success_message_label.setText("Item not found in inventory.")
+            self.success_message_label.setStyleSheet("color: red; font-size: 14px;")
 
     def focus_barcode_input(self):
         """Set focus on the barcode input field."""
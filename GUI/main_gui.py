@@ -1,16 +1,30 @@
 import sys
 import qtawesome as qta
-from PyQt6.QtWidgets import QWidget, QVBoxLayout, QTabWidget, QPushButton, QHBoxLayout
-from PyQt6.QtGui import QPalette, QColor, QIcon, QCursor
+from PyQt6.QtWidgets import (
+    QApplication,
+    QWidget,
+    QVBoxLayout,
+    QTabWidget,
+    QPushButton,
+    QHBoxLayout,
+)
+from PyQt6.QtGui import QPalette, QColor, QIcon, QCursor, QShortcut, QKeySequence
 from PyQt6.QtCore import Qt, QTimer
 from GUI.POS import POSWidget
-from GUI.inv import InventoryWidget
+from excel import ExcelHandler
+from pos import POSHandler
 
 
 class MainApp(QWidget):
-    def __init__(self):
+    def __init__(self, excel_handler=None, client=None):
         super().__init__()
 
+        # Either a local inventory service client or one storage session,
+        # shared by both tabs
+        self.client = client
+        if client is None:
+            self.excel_handler = excel_handler or ExcelHandler()
+
         self.setWindowTitle("POS Al Halal")
         self.setGeometry(100, 100, 700, 500)
 
@@ -30,14 +44,18 @@ class MainApp(QWidget):
         self.tabs = QTabWidget(self)
         self.tabs.setCursor(QCursor(Qt.CursorShape.PointingHandCursor))
 
-        # Add POS and Inventory tabs
-        self.pos_widget = POSWidget()
-        self.inventory_widget = InventoryWidget()
+        # Add POS and Inventory tabs; the Inventory tab is built when first opened
+        self.pos_widget = POSWidget(client or POSHandler(self.excel_handler))
+        self.inventory_widget = None
+        self.inventory_tab = QWidget()
+        self.inventory_tab_layout = QVBoxLayout(self.inventory_tab)
+        self.inventory_tab_layout.setContentsMargins(0, 0, 0, 0)
 
         self.tabs.addTab(
             self.pos_widget, qta.icon("fa5s.shopping-cart"), "Point of Sale"
         )
-        self.tabs.addTab(self.inventory_widget, qta.icon("fa5s.box-open"), "Inventory")
+        self.tabs.addTab(self.inventory_tab, qta.icon("fa5s.box-open"), "Inventory")
+        self.tabs.currentChanged.connect(self.handle_tab_changed)
 
         # Replace Clear Tab with a Button Styled as a Tab
         self.clear_button = QPushButton(" Clear")
@@ -94,6 +112,53 @@ class MainApp(QWidget):
 
         self.previous_tab_index = 0  # Track the previously active tab index
 
+        # Roll over to the new monthly file soon after midnight on the 1st,
+        # on the write queue rather than during a scan
+        # (the inventory service does this itself)
+        if client is None:
+            self.rollover_timer = QTimer(self)
+            self.rollover_timer.timeout.connect(self.check_month_rollover)
+            self.rollover_timer.start(60 * 1000)
+
+        # Ctrl+Shift+M prints where the time goes on this till
+        self.metrics_shortcut = QShortcut(QKeySequence("Ctrl+Shift+M"), self)
+        self.metrics_shortcut.activated.connect(self.print_metrics)
+
+    def handle_tab_changed(self, index):
+        """Build the Inventory tab the first time it is opened."""
+        if index == 1 and self.inventory_widget is None:
+            from GUI.inv import InventoryWidget
+            from inventory import InventoryHandler
+
+            self.inventory_widget = InventoryWidget(
+                self.client or InventoryHandler(self.excel_handler)
+            )
+            self.inventory_tab_layout.addWidget(self.inventory_widget)
+            self.inventory_widget.focus_barcode_input()
+
+    def check_month_rollover(self):
+        self.pos_widget.task_queue.submit_write(
+            self.excel_handler.ensure_current_month,
+            on_error=lambda message: print(f"Error starting new month: {message}"),
+        )
+
+    def warm_up(self):
+        """Load the item index in the background so the first scan is fast."""
+        self.pos_widget.refresh_search_index()
+        self.pos_widget.refresh_discounts()
+        if self.client:
+            return  # The service keeps its index hot
+        self.pos_widget.task_queue.submit_read(
+            self.excel_handler.storage.get_items,
+            on_error=lambda message: print(f"Error loading inventory: {message}"),
+        )
+
+    def print_metrics(self):
+        """Print the p50/p95/p99 latency table for this session."""
+        from metrics import format_summary, metrics
+
+        print(format_summary(metrics.summary()))
+
     def handle_clear_click(self):
         """Change the button text and icon on click, then revert after a delay."""
         self.clear_button.setText(" Cleared!")
@@ -110,7 +175,7 @@ class MainApp(QWidget):
         # Refocus the barcode input based on the active tab
         if active_tab == 0:  # POS tab
             self.pos_widget.focus_barcode_input()
-        elif active_tab == 1:  # Inventory tab
+        elif active_tab == 1 and self.inventory_widget:  # Inventory tab
             self.inventory_widget.focus_barcode_input()
 
     def reset_clear_button(self):
@@ -121,7 +186,16 @@ class MainApp(QWidget):
     def clear_inputs(self):
         """Clear all input fields in POS and Inventory tabs."""
         self.pos_widget.clear_inputs()
-        self.inventory_widget.clear_inputs()
+        if self.inventory_widget:
+            self.inventory_widget.clear_inputs()
+
+    def closeEvent(self, event):
+        """Flush journaled sales into the Excel file before the window closes."""
+        self.pos_widget.task_queue.wait_for_writes()
+        # Deliver their results, so recorded sales free their cart slots
+        QApplication.processEvents()
+        self.pos_widget.pos_handler.close()
+        super().closeEvent(event)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,60 @@
+from PyQt6.QtWidgets import QListWidget, QListWidgetItem
+from PyQt6.QtCore import QObject, Qt, pyqtSignal
+
+# Items with this many units or fewer are listed in the low-stock panel
+LOW_STOCK_LEVEL = 5
+
+
+class StockEvents(QObject):
+    """Carries stock changes from the thread that committed them to the GUI."""
+
+    # {barcode: quantity left}; Qt queues it to the receiver's thread
+    changed = pyqtSignal(dict)
+
+
+class LowStockPanel(QListWidget):
+    """Items about to run out, emptiest first, kept current by stock events."""
+
+    def __init__(self, parent=None, level=LOW_STOCK_LEVEL):
+        super().__init__(parent)
+        self.level = level
+        self.items = {}
+        # barcode -> its row in the list
+        self.entries = {}
+        self.loaded = False
+        self.setStyleSheet("font-size: 13px; color: #b35c00; background-color: white;")
+        self.setMaximumHeight(90)
+        self.hide()
+
+    def load(self, items):
+        """Fill the panel from a barcode -> item dict."""
+        self.items = items
+        self.loaded = True
+        self.update_stock(
+            {
+                barcode: item.get("Inventory Quantity")
+                for barcode, item in items.items()
+                if (item.get("Inventory Quantity") or 0) <= self.level
+            }
+        )
+
+    def update_stock(self, changes):
+        for barcode, quantity in changes.items():
+            entry = self.entries.pop(barcode, None)
+            if entry is not None:
+                self.takeItem(self.row(entry))
+            if quantity is None or quantity > self.level:
+                continue
+            item = self.items.get(barcode)
+            name = item.get("Item Name") if item else None
+            entry = QListWidgetItem(f"{name or barcode}: {quantity} left")
+            entry.setData(Qt.ItemDataRole.UserRole, quantity)
+            row = 0
+            while (
+                row < self.count()
+                and self.item(row).data(Qt.ItemDataRole.UserRole) <= quantity
+            ):
+                row += 1
+            self.insertItem(row, entry)
+            self.entries[barcode] = entry
+        self.setVisible(bool(self.entries))
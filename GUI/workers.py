@@ -0,0 +1,77 @@
+from PyQt6.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+
+
+class WorkerSignals(QObject):
+    """Signals a worker uses to report back to the GUI thread."""
+
+    finished = pyqtSignal(object)
+    error = pyqtSignal(str)
+
+
+class Worker(QRunnable):
+    """Run a function on a pool thread and emit its result or error."""
+
+    def __init__(self, fn, *args, **kwargs):
+        super().__init__()
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.signals = WorkerSignals()
+
+    def run(self):
+        try:
+            result = self.fn(*self.args, **self.kwargs)
+        except Exception as e:
+            self.signals.error.emit(str(e))
+        else:
+            self.signals.finished.emit(result)
+
+
+class TaskQueue:
+    """Keep file I/O off the GUI thread; writes run one at a time, in order."""
+
+    def __init__(self):
+        self.read_pool = QThreadPool.globalInstance()
+        self.write_pool = QThreadPool()
+        self.write_pool.setMaxThreadCount(1)
+        self.active_workers = set()
+
+    def submit_read(self, fn, *args, on_success=None, on_error=None):
+        """Run a lookup in parallel with other work."""
+        return self.submit(self.read_pool, fn, args, on_success, on_error)
+
+    def submit_write(self, fn, *args, on_success=None, on_error=None):
+        """Queue a write behind every write submitted before it."""
+        return self.submit(self.write_pool, fn, args, on_success, on_error)
+
+    def submit(self, pool, fn, args, on_success, on_error):
+        worker = Worker(fn, *args)
+        # Hold a reference until the result has been delivered
+        self.active_workers.add(worker)
+        worker.signals.finished.connect(lambda _: self.active_workers.discard(worker))
+        worker.signals.error.connect(lambda _: self.active_workers.discard(worker))
+        if on_success:
+            worker.signals.finished.connect(on_success)
+        if on_error:
+            worker.signals.error.connect(on_error)
+        pool.start(worker)
+        return worker
+
+    def wait_for_writes(self):
+        """Block until every queued write has finished."""
+        self.write_pool.waitForDone()
+
+    def wait_for_reads(self):
+        """Block until every lookup has finished; results still need the event loop."""
+        self.read_pool.waitForDone()
+
+
+_task_queue = None
+
+
+def get_task_queue():
+    """Return the queue shared by every widget."""
+    global _task_queue
+    if _task_queue is None:
+        _task_queue = TaskQueue()
+    return _task_queue
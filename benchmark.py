@@ -0,0 +1,216 @@
+"""Time the scan, sale and inventory hot paths against synthetic workbooks.
+
+    python benchmark.py [--sizes 1000,10000,100000] [--repeat 5] [--output FILE]
+
+Results are printed (or written) as JSON so runs can be compared.
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+# Qt must not try to open a window on a headless machine
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from excel import HEADERS, ExcelHandler
+from inventory import InventoryHandler
+from metrics import metrics
+from pos import POSHandler
+from search import ItemSearchIndex
+
+
+def make_barcode(i):
+    return f"88{i:011d}"
+
+
+def generate_workbook(path, rows):
+    """Write a monthly workbook in the ExcelHandler layout with `rows` items."""
+    from openpyxl import Workbook
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Benchmark")
+    ws.append(HEADERS)
+    for i in range(1, rows + 1):
+        row = i + 1
+        ws.append(
+            [
+                i,
+                make_barcode(i),
+                f"Item {i}",
+                1000,
+                0,
+                None,
+                1000.0,
+                1500.0,
+                f"=H{row}*E{row}",
+                f"=D{row}*G{row}",
+                f"=I{row}-J{row}",
+            ]
+        )
+    wb.save(path)
+
+
+def measure(fn, repeat):
+    """Run fn `repeat` times and summarize the wall-clock times in ms."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+    return {
+        "runs": repeat,
+        "min_ms": round(min(times), 3),
+        "median_ms": round(statistics.median(times), 3),
+        "mean_ms": round(statistics.mean(times), 3),
+        "max_ms": round(max(times), 3),
+    }
+
+
+def bench_size(rows, repeat, app):
+    from GUI.POS import POSWidget
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "POS_bench.xlsx")
+        start = time.perf_counter()
+        generate_workbook(path, rows)
+        results["generate_workbook"] = {
+            "ms": round((time.perf_counter() - start) * 1000, 3)
+        }
+
+        metrics.reset()
+        excel_handler = ExcelHandler(path)
+        pos_handler = POSHandler(excel_handler)
+        inventory_handler = InventoryHandler(excel_handler)
+        middle = make_barcode(rows // 2)
+        last = make_barcode(rows)
+
+        # The first lookup pays for building the index
+        results["find_item_by_barcode_cold"] = measure(
+            lambda: pos_handler.find_item_by_barcode(last), 1
+        )
+        # A new handler on the same file starts from the sidecar item cache
+        results["find_item_by_barcode_cold_cached"] = measure(
+            lambda: ExcelHandler(path).storage.find_item(last), 1
+        )
+        results["find_item_by_barcode"] = measure(
+            lambda: pos_handler.find_item_by_barcode(last), repeat
+        )
+        results["get_inventory_item"] = measure(
+            lambda: inventory_handler.get_inventory_item(middle), repeat
+        )
+        results["search_index_build"] = measure(
+            lambda: ItemSearchIndex(pos_handler.get_items()), 1
+        )
+        search_index = ItemSearchIndex(pos_handler.get_items())
+        results["search_prefix"] = measure(
+            lambda: search_index.search(f"item {rows // 2}"), repeat
+        )
+        results["search_typo"] = measure(lambda: search_index.search("itme"), repeat)
+        results["update_inventory"] = measure(
+            lambda: pos_handler.update_inventory(last), repeat
+        )
+        results["commit_sale_5_lines"] = measure(
+            lambda: pos_handler.commit_sale(
+                {make_barcode(i): 2 for i in range(rows - 4, rows + 1)}
+            ),
+            repeat,
+        )
+        results["add_inventory_item_update"] = measure(
+            lambda: inventory_handler.add_inventory_item(
+                middle, "Updated item", "900", "1400", "500"
+            ),
+            repeat,
+        )
+        counter = iter(range(rows + 1, rows + 1 + repeat))
+        results["add_inventory_item_insert"] = measure(
+            lambda: inventory_handler.add_inventory_item(
+                make_barcode(next(counter)), "New item", "900", "1400", "10"
+            ),
+            repeat,
+        )
+
+        widget = POSWidget(pos_handler, os.path.join(tmp, "cart.session"))
+
+        def wait_for_scans():
+            while widget.pending_scans:
+                widget.task_queue.wait_for_reads()
+                app.processEvents()
+
+        def process_sale():
+            for barcode in (middle, last, middle, make_barcode(1)):
+                widget.scanner_input.setText(barcode)
+                widget.scan_item()
+            # The sale starts once the scans are in the cart
+            widget.process_sale()
+            wait_for_scans()
+            widget.task_queue.wait_for_writes()
+            app.processEvents()
+            # Include folding the journal into the workbook
+            pos_handler.compactor.compact()
+
+        results["process_sale"] = measure(process_sale, repeat)
+
+        # A scanner burst: barcodes typed faster than they can be looked up
+        burst = [make_barcode(i) for i in range(1, min(rows, 50) + 1)] * 2
+
+        def scan_burst():
+            for barcode in burst:
+                widget.scanner_input.setText(barcode)
+                widget.scan_item()
+            wait_for_scans()
+            widget.clear_inputs()
+
+        results["scan_burst"] = measure(scan_burst, repeat)
+        results["scan_burst"]["scans"] = len(burst)
+        results["scan_burst"]["scans_per_second"] = round(
+            len(burst) / results["scan_burst"]["median_ms"] * 1000, 1
+        )
+
+        pos_handler.close()
+        # Per-stage breakdown from the handlers' own timing spans
+        results["stages"] = metrics.summary()
+        widget.deleteLater()
+        app.processEvents()
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="1000,10000,100000")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="write JSON here instead of stdout")
+    args = parser.parse_args()
+
+    from PyQt6.QtWidgets import QApplication
+
+    app = QApplication.instance() or QApplication(sys.argv[:1])
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "storage": os.environ.get("POS_STORAGE", "excel"),
+        "repeat": args.repeat,
+        "sizes": {},
+    }
+    for size in [int(s) for s in args.sizes.split(",") if s]:
+        print(f"Benchmarking {size} rows...", file=sys.stderr)
+        report["sizes"][str(size)] = bench_size(size, args.repeat, app)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
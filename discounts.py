@@ -0,0 +1,239 @@
+"""Discount rules from data/discounts.xlsx and incremental cart pricing.
+
+The "Discounts" sheet has one rule per row:
+
+    Barcode | Category | Type | Value | Quantity | Start | End
+
+Type is "percent" (Value % off), "fixed" (Value per unit) or "multibuy"
+(Quantity units for Value). A rule targets a Barcode or every item of a
+Category; a category multi-buy mixes items, e.g. any 3 drinks for 5000.
+Start and End are optional dates. The "Categories" sheet maps Barcode to
+Category.
+"""
+
+import os
+from datetime import date
+from metrics import timed
+
+DISCOUNTS_FILE = "discounts.xlsx"
+RULE_TYPES = {"percent", "fixed", "multibuy"}
+
+
+def parse_date(value):
+    """ISO string for a spreadsheet date cell, or None if blank."""
+    import pandas as pd
+
+    if value is None or pd.isna(value):
+        return None
+    return pd.Timestamp(value).date().isoformat()
+
+
+def load_discount_rules(path):
+    """Read the discount sheet into plain rules and a barcode -> category map.
+
+    Both are JSON-friendly, so the inventory service can hand them to tills.
+    Rows that cannot be understood are reported and skipped.
+    """
+    import pandas as pd
+
+    if not os.path.exists(path):
+        return {"rules": [], "categories": {}}
+
+    sheets = pd.read_excel(path, sheet_name=None, dtype={"Barcode": str})
+    categories = {}
+    if "Categories" in sheets:
+        for row in sheets["Categories"].to_dict("records"):
+            if pd.notna(row.get("Barcode")) and pd.notna(row.get("Category")):
+                categories[str(row["Barcode"]).strip()] = str(row["Category"]).strip()
+
+    rules = []
+    frame = sheets.get("Discounts")
+    rows = [] if frame is None else frame.to_dict("records")
+    for row_number, row in enumerate(rows, start=2):
+        try:
+            rule_type = str(row.get("Type", "")).strip().lower()
+            if rule_type not in RULE_TYPES:
+                raise ValueError(f"Type must be one of {sorted(RULE_TYPES)}")
+            barcode = row.get("Barcode")
+            category = row.get("Category")
+            barcode = str(barcode).strip() if pd.notna(barcode) else None
+            category = str(category).strip() if pd.notna(category) else None
+            if not barcode and not category:
+                raise ValueError("Barcode or Category is required")
+            value = float(row["Value"])
+            quantity = row.get("Quantity")
+            quantity = int(quantity) if pd.notna(quantity) else 1
+            if rule_type == "multibuy" and quantity < 2:
+                raise ValueError("Multi-buy needs a Quantity of at least 2")
+            rules.append(
+                {
+                    "barcode": barcode,
+                    "category": category,
+                    "type": rule_type,
+                    "value": value,
+                    "quantity": quantity,
+                    "start": parse_date(row.get("Start")),
+                    "end": parse_date(row.get("End")),
+                }
+            )
+        except (KeyError, TypeError, ValueError) as e:
+            print(f"Skipping discount row {row_number}: {e}")
+    return {"rules": rules, "categories": categories}
+
+
+def rule_label(rule):
+    if rule["type"] == "percent":
+        return f"-{rule['value']:g}%"
+    if rule["type"] == "fixed":
+        return f"now {rule['value']:.2f}"
+    return f"{rule['quantity']} for {rule['value']:.2f}"
+
+
+class DiscountTable:
+    """Rules active on one day, compiled into per-barcode lookup tables."""
+
+    def __init__(self, rules=None, categories=None, today=None):
+        today = today or date.today().isoformat()
+        categories = categories or {}
+        members = {}
+        for barcode, category in categories.items():
+            members.setdefault(category, []).append(barcode)
+
+        # barcode -> rules priced on that line alone
+        self.item_rules = {}
+        # Mixed multi-buys over a category, and barcode -> their ids
+        self.group_rules = []
+        self.groups_by_barcode = {}
+
+        for rule in rules or []:
+            if (rule["start"] and today < rule["start"]) or (
+                rule["end"] and today > rule["end"]
+            ):
+                continue
+            rule = dict(rule, label=rule_label(rule))
+            if rule["barcode"]:
+                self.item_rules.setdefault(rule["barcode"], []).append(rule)
+            elif rule["type"] == "multibuy":
+                group_id = len(self.group_rules)
+                self.group_rules.append(rule)
+                for barcode in members.get(rule["category"], []):
+                    self.groups_by_barcode.setdefault(barcode, []).append(group_id)
+            else:
+                for barcode in members.get(rule["category"], []):
+                    self.item_rules.setdefault(barcode, []).append(rule)
+
+    def __bool__(self):
+        return bool(self.item_rules or self.group_rules)
+
+    def line_price(self, barcode, unit_price, quantity):
+        """Best (total, label) for one line from its own rules."""
+        best = unit_price * quantity
+        label = None
+        for rule in self.item_rules.get(barcode, ()):
+            if rule["type"] == "percent":
+                total = unit_price * quantity * (1 - rule["value"] / 100)
+            elif rule["type"] == "fixed":
+                total = min(rule["value"], unit_price) * quantity
+            else:
+                bundles, rest = divmod(quantity, rule["quantity"])
+                total = bundles * rule["value"] + rest * unit_price
+            if total < best:
+                best = total
+                label = rule["label"]
+        return max(0.0, best), label
+
+
+class CartPricer:
+    """Cart total kept up to date one line at a time.
+
+    A quantity change reprices that line and the mixed multi-buys it is part
+    of; nothing else in the cart is looked at.
+    """
+
+    def __init__(self, table=None):
+        self.table = table or DiscountTable()
+        # barcode -> {"price", "quantity", "total", "label"}
+        self.lines = {}
+        # group id -> barcodes in the cart, and the discount it gives now
+        self.group_lines = {}
+        self.group_discounts = {}
+        self.total = 0.0
+
+    @timed("discounts.set_line")
+    def set_line(self, barcode, unit_price, quantity):
+        """Set a line's quantity (0 removes it) and return the new cart total."""
+        old = self.lines.get(barcode)
+        old_total = old["total"] if old else 0.0
+        if quantity <= 0:
+            self.lines.pop(barcode, None)
+            new_total = 0.0
+        else:
+            new_total, label = self.table.line_price(barcode, unit_price, quantity)
+            self.lines[barcode] = {
+                "price": unit_price,
+                "quantity": quantity,
+                "total": new_total,
+                "label": label,
+            }
+        self.total += new_total - old_total
+
+        for group_id in self.table.groups_by_barcode.get(barcode, ()):
+            in_group = self.group_lines.setdefault(group_id, set())
+            if quantity > 0:
+                in_group.add(barcode)
+            else:
+                in_group.discard(barcode)
+            self.update_group(group_id)
+        return self.total
+
+    def update_group(self, group_id):
+        """Reprice one mixed multi-buy from the lines that take part in it."""
+        rule = self.table.group_rules[group_id]
+        units = []
+        for barcode in self.group_lines[group_id]:
+            line = self.lines[barcode]
+            units.append((line["total"] / line["quantity"], line["quantity"]))
+        units.sort(reverse=True)
+        bundled = sum(qty for _price, qty in units) // rule["quantity"]
+        # The bundle takes the dearest units, which favours the customer
+        remaining = bundled * rule["quantity"]
+        full_price = 0.0
+        for price, qty in units:
+            take = min(qty, remaining)
+            full_price += price * take
+            remaining -= take
+        discount = max(0.0, full_price - bundled * rule["value"])
+
+        self.total -= discount - self.group_discounts.get(group_id, 0.0)
+        self.group_discounts[group_id] = discount
+
+    def line_label(self, barcode):
+        line = self.lines.get(barcode)
+        labels = [line["label"]] if line and line["label"] else []
+        for group_id in self.table.groups_by_barcode.get(barcode, ()):
+            if self.group_discounts.get(group_id):
+                labels.append(self.table.group_rules[group_id]["label"])
+        return ", ".join(labels)
+
+    def get_discounts(self):
+        """Discount per barcode; mixed multi-buys are split by quantity."""
+        discounts = {
+            barcode: line["price"] * line["quantity"] - line["total"]
+            for barcode, line in self.lines.items()
+        }
+        for group_id, discount in self.group_discounts.items():
+            barcodes = self.group_lines.get(group_id, ())
+            units = sum(self.lines[barcode]["quantity"] for barcode in barcodes)
+            for barcode in barcodes:
+                discounts[barcode] += discount * self.lines[barcode]["quantity"] / units
+        return {
+            barcode: round(discount, 2)
+            for barcode, discount in discounts.items()
+            if discount > 0.005
+        }
+
+    def clear(self):
+        self.lines = {}
+        self.group_lines = {}
+        self.group_discounts = {}
+        self.total = 0.0
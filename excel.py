@@ -1,13 +1,63 @@
+import glob
+import math
 import os
-from openpyxl import Workbook, load_workbook
-from openpyxl.styles import Alignment, Font
+import re
+import threading
 from datetime import datetime
+from itemcache import read_item_cache, write_item_cache
+from locks import FileLock
+from metrics import span, timed
+
+# pandas and openpyxl are imported inside the methods that need them so that
+# the window can appear before those libraries finish loading
+
+HEADERS = [
+    "No",
+    "Barcode",
+    "Item Name",
+    "Inventory Quantity",
+    "Quantity Sold",
+    "Quantity Left",
+    "Original Price",
+    "Sale Price",
+    "Total Profit",
+    "Invested",
+    "Clean Profit",
+    None,
+]
+
+QUANTITY_COLUMNS = ("Inventory Quantity", "Quantity Sold", "Quantity Left")
+
+
+MONTH_FILE_PATTERN = re.compile(r"POS_\d{4}_\d{2}\.xlsx$")
 
 
 class ExcelHandler:
-    def __init__(self):
-        self.file_path = self.get_excel_path()
+    def __init__(self, file_path=None):
+        # Follow the calendar month unless pinned to a specific file
+        self.auto_rollover = file_path is None
+        self.file_path = file_path or self.get_excel_path()
         self.create_excel_if_not_exists()
+        self._item_index = None
+        self._index_version = None
+        # Workbook version the sidecar item cache was last written for
+        self._cache_version = None
+        # Guards the cached index; held only to read, swap or patch it
+        self.lock = threading.RLock()
+        # Serializes workbook loads, edits and saves, and month rollovers.
+        # Take it before self.lock; lookups only wait on it when the index
+        # has to be rebuilt
+        self.write_lock = threading.RLock()
+        # True while a save that will patch the index is writing the file
+        self.saving = False
+        self.rolling_over = False
+        # Called before switching months, e.g. to flush the sales journal
+        self.rollover_callbacks = []
+        # Called with {barcode: quantity left} after a write changes stock
+        self.stock_callbacks = []
+        self.storage = self.create_storage()
+        self.price_history = None
+        self.snapshots = None
 
     def get_excel_path(self):
         """Generate file path based on the current year and month."""
@@ -18,50 +68,311 @@ class ExcelHandler:
 
     def create_excel_if_not_exists(self):
         """Create a new Excel file with the necessary structure if it does not exist."""
-        if not os.path.exists(self.file_path):
-            wb = Workbook()
-            month_name = datetime.now().strftime("%B")
-            ws = wb.active
-            ws.title = month_name
-
-            # Define headers
-            headers = [
-                "No",
-                "Barcode",
-                "Item Name",
-                "Inventory Quantity",
-                "Quantity Sold",
-                "Quantity Left",
-                "Original Price",
-                "Sale Price",
-                "Total Profit",
-                "Invested",
-                "Clean Profit",
-                None,
-            ]
+        if os.path.exists(self.file_path):
+            return
+        os.makedirs(os.path.dirname(self.file_path) or ".", exist_ok=True)
+        # Another till starting at the same time creates it only once. Locks
+        # are taken newest month first, as a rollover does
+        with FileLock(self.get_lock_path()):
+            if os.path.exists(self.file_path):
+                return
+            items = {}
+            if self.auto_rollover:
+                items = self.load_previous_month_items()
+            self.create_month_file(self.file_path, items)
+
+    def create_month_file(self, path, items):
+        """Write a new monthly file whose stock is carried over from `items`."""
+        wb = self.new_workbook()
+        ws = wb.active
+        for row, item in enumerate(items.values(), start=2):
+            # What was left last month is this month's inventory. Sales and
+            # restocks both update Inventory Quantity, so it is the live stock
+            values = {
+                "No": row - 1,
+                "Barcode": item["Barcode"],
+                "Item Name": item.get("Item Name"),
+                "Inventory Quantity": item.get("Inventory Quantity") or 0,
+                "Original Price": item.get("Original Price"),
+                "Sale Price": item.get("Sale Price"),
+            }
+            for column_name, value in values.items():
+                cell = ws.cell(
+                    row=row, column=HEADERS.index(column_name) + 1, value=value
+                )
+                self.apply_formatting(cell, column_name)
+            self.write_formulas(ws, row)
+        wb.save(path)
+
+    def get_previous_month_path(self):
+        """Latest monthly file older than the current one, or None."""
+        folder = os.path.dirname(self.file_path)
+        current = os.path.basename(self.file_path)
+        candidates = [
+            path
+            for path in glob.glob(os.path.join(folder, "POS_*.xlsx"))
+            if MONTH_FILE_PATTERN.match(os.path.basename(path))
+            and os.path.basename(path) < current
+        ]
+        return max(candidates) if candidates else None
+
+    def load_previous_month_items(self):
+        """Read last month's items, after replaying its unfinished sales."""
+        previous_path = self.get_previous_month_path()
+        if previous_path is None:
+            return {}
+
+        from ledger import replay_ledger
+
+        previous = ExcelHandler(previous_path)
+        replay_ledger(previous)
+        items = previous.storage.get_items()
+        previous.storage.close()
+        return items
+
+    def ensure_current_month(self):
+        """Switch to a new monthly file after midnight on the 1st.
+
+        Stock comes from the index already in memory, so nothing is re-read.
+        """
+        if not self.auto_rollover or self.rolling_over:
+            return
+        new_path = self.get_excel_path()
+        if new_path == self.file_path:
+            return
+
+        # The new month's lock keeps other processes from creating the file
+        # while this one is still carrying stock over
+        with self.write_lock, FileLock(self.get_lock_path(new_path)):
+            # Another thread may have finished the switch while we waited
+            if new_path == self.file_path or self.rolling_over:
+                return
+            self.rolling_over = True
+            try:
+                for callback in self.rollover_callbacks:
+                    callback()
+                if not os.path.exists(new_path):
+                    self.create_month_file(new_path, self.storage.get_items())
+                with self.lock:
+                    self.file_path = new_path
+                    self.invalidate_item_index()
+                self.storage.switch_file()
+            finally:
+                self.rolling_over = False
+
+    def new_workbook(self):
+        """Build an empty workbook with the headers and formula templates."""
+        from openpyxl import Workbook
+
+        wb = Workbook()
+        month_name = datetime.now().strftime("%B")
+        ws = wb.active
+        ws.title = month_name
+
+        ws.append(HEADERS)
+
+        # Apply alignment and style to headers
+        for cell in ws[1]:
+            self.apply_formatting(cell, "header")
 
-            ws.append(headers)
+        # Add formula templates for first 100 rows
+        for row in range(2, 102):
+            self.write_formulas(ws, row)
 
-            # Apply alignment and style to headers
-            for cell in ws[1]:
-                self.apply_formatting(cell, "header")
+        return wb
 
-            # Add formula templates for first 100 rows
-            for row in range(2, 102):
-                ws[f"I{row}"] = f"=H{row}*E{row}"
-                ws[f"J{row}"] = f"=D{row}*G{row}"
-                ws[f"K{row}"] = f"=I{row}-J{row}"
+    def write_formulas(self, ws, row):
+        """Write the profit formulas for one row."""
+        ws[f"I{row}"] = f"=H{row}*E{row}"
+        ws[f"J{row}"] = f"=D{row}*G{row}"
+        ws[f"K{row}"] = f"=I{row}-J{row}"
 
-            wb.save(self.file_path)
+    def notify_stock(self, changes):
+        """Tell subscribers the stock now on record for the changed barcodes."""
+        for callback in list(self.stock_callbacks):
+            try:
+                callback(changes)
+            except Exception as e:
+                print(f"Error notifying stock change: {e}")
 
+    def get_price_history(self):
+        """Price history shared by every handler on this data folder."""
+        with self.lock:
+            if self.price_history is None:
+                from prices import HISTORY_FILE, PriceHistory
+
+                data_dir = os.path.dirname(self.file_path) or "."
+                self.price_history = PriceHistory(os.path.join(data_dir, HISTORY_FILE))
+            return self.price_history
+
+    def get_snapshots(self):
+        """Snapshot store of this data folder; POS_SNAPSHOTS=0 turns it off."""
+        if os.environ.get("POS_SNAPSHOTS", "1") == "0":
+            return None
+        with self.lock:
+            if self.snapshots is None:
+                from snapshots import SnapshotStore, get_snapshot_root
+
+                self.snapshots = SnapshotStore(get_snapshot_root(self.file_path))
+            return self.snapshots
+
+    def take_snapshot(self, wb, path=None, changed_rows=None, previous_version=None):
+        """Record a just-saved workbook; a failed snapshot never fails the save."""
+        snapshots = self.get_snapshots()
+        if snapshots is None:
+            return
+        path = path or self.file_path
+        try:
+            stat = os.stat(path)
+            snapshots.take(
+                path,
+                wb,
+                changed_rows,
+                previous_version,
+                (stat.st_mtime_ns, stat.st_size),
+            )
+        except Exception as e:
+            print(f"Error taking snapshot of {path}: {e}")
+
+    def get_lock_path(self, path=None):
+        """FileLock path of a monthly file, by default the current one."""
+        return (path or self.file_path) + ".lock"
+
+    def create_storage(self):
+        """Pick the storage backend; set POS_STORAGE=sqlite to use SQLite."""
+        from storage import SQLiteStorage, WorkbookStorage
+
+        if os.environ.get("POS_STORAGE", "excel").lower() == "sqlite":
+            return SQLiteStorage(self)
+        return WorkbookStorage(self)
+
+    @timed("excel.load_workbook")
     def load_workbook(self):
         """Load the workbook."""
+        from openpyxl import load_workbook
+
         return load_workbook(self.file_path)
 
-    def save_workbook(self, wb):
-        """Save the workbook."""
-        wb.save(self.file_path)
+    @timed("excel.save_workbook")
+    def save_workbook(self, wb, changed_items=None, changed_rows=None):
+        """Save the workbook and snapshot it.
+
+        changed_items maps barcode -> {column: value} for the rows this save
+        touched; when given, the cached index is patched instead of dropped,
+        and lookups keep using it while the file is written. changed_rows are
+        those rows' sheet numbers, so the snapshot only re-reads them.
+        """
+        with self.write_lock:
+            with self.lock:
+                previous_version = self.get_file_version()
+                index_was_current = (
+                    self._item_index is not None
+                    and self._index_version == previous_version
+                )
+                self.saving = changed_items is not None and index_was_current
+            saved = False
+            try:
+                wb.save(self.file_path)
+                saved = True
+            finally:
+                with self.lock:
+                    if self.saving and saved:
+                        for barcode, values in changed_items.items():
+                            if barcode not in self._item_index:
+                                self._item_index[barcode] = {
+                                    header: None for header in HEADERS if header
+                                }
+                            self._item_index[barcode].update(values)
+                        self._index_version = self.get_file_version()
+                    else:
+                        self.invalidate_item_index()
+                    self.saving = False
+            self.take_snapshot(
+                wb, changed_rows=changed_rows, previous_version=previous_version
+            )
+
+    def get_file_version(self):
+        """Return a stamp that changes whenever the Excel file is rewritten."""
+        stat = os.stat(self.file_path)
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def get_item_index(self):
+        """Return a barcode -> item dict, re-read only when the file changes.
+
+        Do not call it with self.lock held: a rebuild waits for writes first.
+        """
+        with self.lock:
+            if self._item_index is not None and (
+                self.saving or self._index_version == self.get_file_version()
+            ):
+                return self._item_index
+        # Missing, or changed by another process; our own write may be
+        # finishing, so wait for it rather than parse a half-written file
+        with self.write_lock, self.lock:
+            version = self.get_file_version()
+            if self._item_index is None or version != self._index_version:
+                with span("excel.load_item_cache"):
+                    self._item_index = read_item_cache(self.get_cache_path(), version)
+                if self._item_index is not None:
+                    self._index_version = self._cache_version = version
+                    return self._item_index
+
+                import pandas as pd
+
+                with span("excel.build_item_index"):
+                    df = pd.read_excel(
+                        self.file_path, dtype={"Barcode": str}, engine="openpyxl"
+                    )
+                    df = df[df["Barcode"].notna()]
+                    # Keep the first row for duplicated barcodes, like the old lookup did
+                    df = df.drop_duplicates(subset="Barcode", keep="first")
+                    self._item_index = {
+                        item["Barcode"]: self.clean_item(item)
+                        for item in df.to_dict("records")
+                    }
+                self._index_version = version
+                self.save_item_cache()
+            return self._item_index
+
+    def get_cache_path(self):
+        return self.file_path + ".items"
+
+    def save_item_cache(self):
+        """Write the sidecar for the cached index unless it is already current.
 
+        Runs after the workbook is parsed and when the app closes, so the next
+        start only parses the file if something else changed it.
+        """
+        with self.lock:
+            if self._item_index is None or self._index_version == self._cache_version:
+                return
+            if self._index_version != self.get_file_version():
+                return
+            try:
+                with span("excel.save_item_cache"):
+                    written = write_item_cache(
+                        self.get_cache_path(), self._item_index, self._index_version
+                    )
+            except OSError as e:
+                print(f"Error writing item cache: {e}")
+                return
+            if written:
+                self._cache_version = self._index_version
+
+    def clean_item(self, item):
+        """Turn pandas NaN into None and whole-number quantities back into ints."""
+        for key, value in item.items():
+            if isinstance(value, float) and math.isnan(value):
+                item[key] = None
+            elif key in QUANTITY_COLUMNS and value is not None:
+                item[key] = int(value)
+        return item
+
+    def invalidate_item_index(self):
+        """Drop the cached barcode index so the next lookup re-reads the file."""
+        self._item_index = None
+
+    @timed("excel.get_column_indexes")
     def get_column_indexes(self, ws):
         """Retrieve column indexes based on header names."""
         try:
@@ -83,12 +394,18 @@ class ExcelHandler:
                     f"Missing required columns in Excel: {missing_columns}"
                 )
 
-            return {col: headers[col] for col in required_columns}
+            columns = {col: headers[col] for col in required_columns}
+            # Sales bookkeeping columns are only present in newer files
+            for col in ("Quantity Sold", "Quantity Left"):
+                if col in headers:
+                    columns[col] = headers[col]
+            return columns
 
         except Exception as e:
             print(f"Error getting column indexes: {e}")
             return {}
 
+    @timed("excel.find_first_empty_row")
     def find_first_empty_row(self, ws, barcode_col):
         """Find the first available empty row in the Barcode column."""
         for row in range(2, ws.max_row + 1):  # Start from row 2 (skip headers)
@@ -98,12 +415,26 @@ class ExcelHandler:
 
     def apply_formatting(self, cell, cell_type):
         """Apply alignment and formatting to a cell."""
-        cell.alignment = Alignment(horizontal="center", vertical="center")
+        styles = get_styles()
+        cell.alignment = styles["alignment"]
         if cell_type == "header":
-            cell.font = Font(name="Calibri", size=11, bold=True)
+            cell.font = styles["header_font"]
         else:
-            cell.font = Font(name="Calibri", size=11)
+            cell.font = styles["font"]
+
+
+_styles = None
+
 
+def get_styles():
+    """Style objects shared by every formatted cell instead of one per cell."""
+    global _styles
+    if _styles is None:
+        from openpyxl.styles import Alignment, Font
 
-# Instantiate the ExcelHandler to create or load the Excel file
-excel_handler = ExcelHandler()
+        _styles = {
+            "alignment": Alignment(horizontal="center", vertical="center"),
+            "header_font": Font(name="Calibri", size=11, bold=True),
+            "font": Font(name="Calibri", size=11),
+        }
+    return _styles
@@ -1,73 +1,247 @@
-from openpyxl import load_workbook
+import math
+import os
+import sys
 from excel import ExcelHandler
+from metrics import timed
+
+# Header names seen in supplier spreadsheets, mapped to our column names.
+# A supplier file needs all five columns; the item name may be left blank.
+IMPORT_COLUMN_ALIASES = {
+    "Barcode": ["barcode", "바코드", "ean", "upc"],
+    "Item Name": ["item name", "name", "상품명", "품명"],
+    "Original Price": ["original price", "cost", "unit cost", "매입가", "원가"],
+    "Sale Price": ["sale price", "price", "판매가"],
+    "Inventory Quantity": ["inventory quantity", "quantity", "qty", "수량"],
+}
+
+# Columns of the old till's daily sales report (e.g. data/2025.01.26.xls):
+# gross, net and actual sales. It lists quantities sold by name, with no
+# barcodes or prices, so it cannot be imported as stock.
+SALES_REPORT_COLUMNS = ["총매출액", "순매출액", "실매출액"]
 
 
 class InventoryHandler:
-    def __init__(self):
-        self.excel_handler = ExcelHandler()
+    def __init__(self, excel_handler=None):
+        # Share one ExcelHandler between handlers so the file is set up once
+        self.excel_handler = excel_handler or ExcelHandler()
+        self.storage = self.excel_handler.storage
 
+    @timed("inventory.add_inventory_item")
     def add_inventory_item(
         self, barcode, item_name, original_price, sale_price, inventory_quantity
     ):
-        wb = self.excel_handler.load_workbook()
-        ws = wb.active
-
-        columns = self.excel_handler.get_column_indexes(ws)
-
-        # Validate and sanitize inputs
-        barcode = str(barcode).strip()
-        item_name = str(item_name).strip()
-        try:
-            original_price = float(original_price)
-        except ValueError:
-            raise ValueError("Original Price must be a valid number.")
-        try:
-            sale_price = float(sale_price)
-        except ValueError:
-            raise ValueError("Sale Price must be a valid number.")
-        try:
-            inventory_quantity = int(inventory_quantity)
-        except ValueError:
-            raise ValueError("Inventory Quantity must be a valid integer.")
-
-        # Check if the barcode already exists
-        existing_row = None
-        for row in range(2, ws.max_row + 1):  # Start from row 2 (skip headers)
-            if str(ws.cell(row=row, column=columns["Barcode"]).value) == barcode:
-                existing_row = row
-                break
-
-        target_row = (
-            existing_row
-            if existing_row
-            else self.excel_handler.find_first_empty_row(ws, columns["Barcode"])
+        item = validate_item(
+            barcode, item_name, original_price, sale_price, inventory_quantity
+        )
+        old_item = self.storage.find_item(item["Barcode"])
+        self.storage.upsert_item(item)
+        # Keep the old prices for sales made before this change
+        self.excel_handler.get_price_history().record_changes(
+            [item], {item["Barcode"]: old_item} if old_item else {}
         )
 
-        data = {
-            "Barcode": barcode,
-            "Item Name": item_name,
-            "Inventory Quantity": inventory_quantity,
-            "Original Price": original_price,
-            "Sale Price": sale_price,
-        }
+    @timed("inventory.get_inventory_item")
+    def get_inventory_item(self, barcode):
+        return self.storage.find_item(str(barcode))
 
-        for column_name, value in data.items():
-            cell = ws.cell(row=target_row, column=columns[column_name], value=value)
-            self.excel_handler.apply_formatting(cell, column_name)
+    @timed("inventory.import_items")
+    def import_items(self, path, add_to_stock=True):
+        """Merge a supplier xls/xlsx/csv into the inventory with a single write.
 
-        self.excel_handler.save_workbook(wb)
+        Rows are validated with the same rules as add_inventory_item. Lines
+        for the same barcode are combined: quantities are summed and the last
+        prices win. With add_to_stock the delivered quantity is added to the
+        current stock instead of replacing it.
 
-    def get_inventory_item(self, barcode):
-        wb = self.excel_handler.load_workbook()
-        ws = wb.active
+        Returns (number of items imported, list of rejected rows).
+        """
+        import pandas as pd
 
-        columns = self.excel_handler.get_column_indexes(ws)
+        valid_frames = []
+        rejected = []
+        for chunk in read_supplier_file(path):
+            valid, chunk_rejected = validate_import_rows(chunk)
+            valid_frames.append(valid)
+            rejected.extend(chunk_rejected)
 
-        for row in range(2, ws.max_row + 1):
-            if str(ws.cell(row=row, column=columns["Barcode"]).value) == str(barcode):
-                return {
-                    column_name: ws.cell(row=row, column=col_index).value
-                    for column_name, col_index in columns.items()
+        if not valid_frames or sum(len(frame) for frame in valid_frames) == 0:
+            return 0, rejected
+
+        rows = pd.concat(valid_frames)
+        merged = rows.groupby("Barcode", sort=False).agg(
+            {
+                "Item Name": "last",
+                "Inventory Quantity": "sum",
+                "Original Price": "last",
+                "Sale Price": "last",
+            }
+        )
+
+        # A blank name keeps the name already on file
+        current_items = self.storage.get_items()
+        items = []
+        for barcode, row in merged.iterrows():
+            item_name = row["Item Name"]
+            if not item_name and barcode in current_items:
+                item_name = current_items[barcode]["Item Name"] or ""
+            items.append(
+                {
+                    "Barcode": barcode,
+                    "Item Name": item_name,
+                    "Inventory Quantity": int(row["Inventory Quantity"]),
+                    "Original Price": float(row["Original Price"]),
+                    "Sale Price": float(row["Sale Price"]),
                 }
+            )
+
+        old_items = {
+            item["Barcode"]: dict(current_items[item["Barcode"]])
+            for item in items
+            if item["Barcode"] in current_items
+        }
+        self.storage.upsert_items(items, add_quantity=add_to_stock)
+        self.excel_handler.get_price_history().record_changes(items, old_items)
+        return len(items), rejected
+
+
+def parse_number(value, message):
+    """value as a finite float; raises ValueError(message) otherwise."""
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(message)
+    if not math.isfinite(number):
+        raise ValueError(message)
+    return number
+
+
+def validate_item(barcode, item_name, original_price, sale_price, inventory_quantity):
+    """Validate and sanitize one item's fields into a storage item dict.
+
+    Follows the same rules as validate_import_rows, so an item is accepted
+    the same way whether it is typed in or imported.
+    """
+    barcode = str(barcode).strip()
+    item_name = str(item_name).strip()
+    if not barcode:
+        raise ValueError("Barcode is required.")
+    original_price = parse_number(
+        original_price, "Original Price must be a valid number."
+    )
+    sale_price = parse_number(sale_price, "Sale Price must be a valid number.")
+    # Spreadsheets often store counts as floats, e.g. "3.0"
+    message = "Inventory Quantity must be a valid integer."
+    inventory_quantity = parse_number(inventory_quantity, message)
+    if inventory_quantity % 1 != 0:
+        raise ValueError(message)
+    inventory_quantity = int(inventory_quantity)
+
+    return {
+        "Barcode": barcode,
+        "Item Name": item_name,
+        "Inventory Quantity": inventory_quantity,
+        "Original Price": original_price,
+        "Sale Price": sale_price,
+    }
+
+
+def read_supplier_file(path, chunksize=10000):
+    """Yield the supplier rows as string DataFrames with our column names.
+
+    Raises ValueError if a column of IMPORT_COLUMN_ALIASES is missing.
+    """
+    import pandas as pd
+
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".csv":
+        frames = pd.read_csv(path, dtype=str, chunksize=chunksize)
+    elif extension in (".xls", ".xlsx"):
+        frames = [pd.read_excel(path, dtype=str)]
+    else:
+        raise ValueError(f"Unsupported file type: {extension}")
+
+    start = 2  # Spreadsheet row of the first data line
+    for frame in frames:
+        frame = frame.rename(columns=match_import_columns(frame.columns))
+        missing_columns = [
+            col for col in IMPORT_COLUMN_ALIASES if col not in frame.columns
+        ]
+        if missing_columns and any(
+            col in frame.columns for col in SALES_REPORT_COLUMNS
+        ):
+            raise ValueError(
+                "This is a sales report, not a supplier file: it has no "
+                f"barcodes or prices. Required columns: {list(IMPORT_COLUMN_ALIASES)}"
+            )
+        if missing_columns:
+            raise ValueError(f"Missing required columns in import: {missing_columns}")
+        frame.index = range(start, start + len(frame))
+        start += len(frame)
+        yield frame
+
+
+def match_import_columns(columns):
+    """Map supplier headers to ours using IMPORT_COLUMN_ALIASES."""
+    mapping = {}
+    for column in columns:
+        key = str(column).strip().lower()
+        for name, aliases in IMPORT_COLUMN_ALIASES.items():
+            if key == name.lower() or key in aliases:
+                mapping.setdefault(column, name)
+    return mapping
+
+
+def validate_import_rows(frame):
+    """Split rows into valid ones and rejected {row, barcode, reason} records."""
+    import pandas as pd
+
+    barcode = frame["Barcode"].fillna("").str.strip()
+    item_name = frame["Item Name"].fillna("").str.strip()
+    # Infinite values count as missing, as in validate_item
+    numbers = frame[["Original Price", "Sale Price", "Inventory Quantity"]].apply(
+        pd.to_numeric, errors="coerce"
+    )
+    numbers = numbers.mask(numbers.abs() == math.inf)
+    original_price = numbers["Original Price"]
+    sale_price = numbers["Sale Price"]
+    quantity = numbers["Inventory Quantity"]
+
+    # First failing rule wins, in the same order add_inventory_item checks them
+    checks = [
+        (barcode == "", "Barcode is required."),
+        (original_price.isna(), "Original Price must be a valid number."),
+        (sale_price.isna(), "Sale Price must be a valid number."),
+        (
+            quantity.isna() | (quantity % 1 != 0),
+            "Inventory Quantity must be a valid integer.",
+        ),
+    ]
+    reason = pd.Series(None, index=frame.index, dtype=object)
+    for failed, message in checks:
+        reason = reason.mask(failed & reason.isna(), message)
+
+    bad = reason.notna()
+    rejected = [
+        {"row": row, "barcode": barcode[row], "reason": reason[row]}
+        for row in frame.index[bad]
+    ]
+    valid = pd.DataFrame(
+        {
+            "Barcode": barcode,
+            "Item Name": item_name,
+            "Original Price": original_price,
+            "Sale Price": sale_price,
+            "Inventory Quantity": quantity,
+        }
+    )[~bad]
+    return valid, rejected
+
 
-        return None
+if __name__ == "__main__":
+    # python inventory.py <supplier file> [--replace]
+    imported, rejected = InventoryHandler().import_items(
+        sys.argv[1], add_to_stock="--replace" not in sys.argv
+    )
+    for row in rejected:
+        print(f"Row {row['row']} ({row['barcode']}): {row['reason']}")
+    print(f"Imported {imported} items, rejected {len(rejected)} rows.")
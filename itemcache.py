@@ -0,0 +1,224 @@
+"""Binary sidecar cache of a monthly workbook's items.
+
+POS_YYYY_MM.xlsx.items holds the same barcode -> item dict that
+ExcelHandler.get_item_index() builds with pandas, laid out in columns:
+
+    header     magic, byte-order mark, workbook mtime_ns and size,
+               item count, column count
+    directory  per column: name, kind and data offset
+    data       one fixed-width array per column, 8-byte aligned
+    strings    every distinct text value, NUL-separated UTF-8
+
+Column kinds are "i" (int64, INT_NONE for empty), "f" (float64, NaN for
+empty), "s" (int32 index into the strings, -1 for empty) and "j" (like "s"
+but JSON, for columns mixing types). The file is memory-mapped on load and
+trusted only while the workbook's mtime and size still match. Items are
+decoded one at a time as they are looked up, so opening even a large
+inventory only costs decoding its barcodes.
+"""
+
+import json
+import math
+import mmap
+import os
+import struct
+from array import array
+from collections.abc import MutableMapping
+
+MAGIC = b"POSITEM1"
+BYTE_ORDER_MARK = 0x01020304
+# magic, byte-order mark, workbook mtime_ns, workbook size, items, columns
+HEADER = struct.Struct("=8sIqqII")
+# name, kind, data offset
+COLUMN = struct.Struct("=64s1s7xQ")
+# length of the string table
+STRINGS = struct.Struct("=Q")
+INT_NONE = -(2**63)
+ARRAY_CODES = {"i": "q", "f": "d", "s": "i", "j": "i"}
+
+
+def column_kind(values):
+    """Narrowest kind that gives back exactly these values."""
+    types = {type(value) for value in values if value is not None}
+    if types <= {int}:
+        return "i"
+    if types == {float}:
+        return "f"
+    if types == {str}:
+        return "s"
+    return "j"
+
+
+def align(offset):
+    return (offset + 7) // 8 * 8
+
+
+def write_item_cache(path, items, version):
+    """Write items (barcode -> item dict) as the sidecar for workbook `version`.
+
+    Returns False without writing if the items cannot be stored exactly, e.g.
+    when they do not all have the same fields or hold dates.
+    """
+    rows = list(items.values())
+    names = list(rows[0]) if rows else []
+    if any(list(item) != names for item in rows):
+        return False
+
+    strings = {}
+
+    def string_index(text):
+        return strings.setdefault(text, len(strings))
+
+    sections = []
+    for name in names:
+        values = [item[name] for item in rows]
+        kind = column_kind(values)
+        if kind == "i":
+            data = [INT_NONE if value is None else value for value in values]
+        elif kind == "f":
+            data = [math.nan if value is None else value for value in values]
+        elif kind == "s":
+            data = [-1 if value is None else string_index(value) for value in values]
+        else:
+            try:
+                data = [
+                    -1 if value is None else string_index(json.dumps(value))
+                    for value in values
+                ]
+            except TypeError:
+                return False
+        try:
+            sections.append((name, kind, array(ARRAY_CODES[kind], data).tobytes()))
+        except OverflowError:
+            return False
+
+    table = "\0".join(strings).encode("utf-8")
+    offset = align(HEADER.size + COLUMN.size * len(names))
+    directory = []
+    body = bytearray()
+    for name, kind, data in sections:
+        directory.append(
+            COLUMN.pack(name.encode("utf-8"), kind.encode(), offset + len(body))
+        )
+        body += data
+        body += bytes(align(len(body)) - len(body))
+
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, BYTE_ORDER_MARK, *version, len(rows), len(names)))
+        f.write(b"".join(directory))
+        f.write(bytes(offset - f.tell()))
+        f.write(body)
+        f.write(STRINGS.pack(len(table)))
+        f.write(table)
+    os.replace(temp_path, path)
+    return True
+
+
+def read_item_cache(path, version):
+    """Items stored in the sidecar, or None if it is missing or out of date."""
+    try:
+        with open(path, "rb") as f, mmap.mmap(
+            f.fileno(), 0, access=mmap.ACCESS_READ
+        ) as mm:
+            return read_mapping(mm, version)
+    except (OSError, KeyError, ValueError, struct.error) as e:
+        if not isinstance(e, FileNotFoundError):
+            print(f"Ignoring item cache {path}: {e}")
+        return None
+
+
+def read_mapping(mm, version):
+    magic, mark, mtime_ns, size, count, column_count = HEADER.unpack_from(mm, 0)
+    if magic != MAGIC or mark != BYTE_ORDER_MARK or (mtime_ns, size) != version:
+        return None
+
+    directory = []
+    end = 0
+    for i in range(column_count):
+        name, kind, offset = COLUMN.unpack_from(mm, HEADER.size + i * COLUMN.size)
+        kind = kind.decode()
+        directory.append((name.rstrip(b"\0").decode("utf-8"), kind, offset))
+        end = max(end, align(offset + count * array(ARRAY_CODES[kind]).itemsize))
+    (table_size,) = STRINGS.unpack_from(mm, end)
+    start = end + STRINGS.size
+    strings = mm[start : start + table_size].decode("utf-8").split("\0")
+
+    columns = []
+    for name, kind, offset in directory:
+        code = ARRAY_CODES[kind]
+        # Copied out of the mapping so the file can be replaced while in use
+        data = memoryview(mm[offset : offset + count * array(code).itemsize])
+        columns.append((name, kind, data.cast(code)))
+    return CachedItems(columns, strings)
+
+
+class CachedItems(MutableMapping):
+    """barcode -> item over the sidecar's columns.
+
+    Only the barcodes are decoded up front; an item's dict is built the
+    first time it is looked up and kept, so it can be updated in place like
+    the dicts of a parsed index.
+    """
+
+    def __init__(self, columns, strings):
+        self.columns = columns
+        self.strings = strings
+        barcodes = self.column_values("Barcode")
+        self.positions = dict(zip(barcodes, range(len(barcodes))))
+        self.loaded = {}
+
+    def column_values(self, name):
+        for column_name, kind, data in self.columns:
+            if column_name == name:
+                return [self.decode(kind, value) for value in data]
+        raise KeyError(name)
+
+    def decode(self, kind, value):
+        if kind == "i":
+            return None if value == INT_NONE else value
+        if kind == "f":
+            return None if value != value else value
+        if value < 0:
+            return None
+        if kind == "s":
+            return self.strings[value]
+        return json.loads(self.strings[value])
+
+    def copy(self):
+        """A copy that later inserts and deletes here do not change, like dict.copy."""
+        items = CachedItems.__new__(CachedItems)
+        items.columns = self.columns
+        items.strings = self.strings
+        items.positions = dict(self.positions)
+        items.loaded = dict(self.loaded)
+        return items
+
+    def __getitem__(self, barcode):
+        item = self.loaded.get(barcode)
+        if item is None:
+            position = self.positions[barcode]
+            item = {
+                name: self.decode(kind, data[position])
+                for name, kind, data in self.columns
+            }
+            # Another thread may have built and changed it meanwhile
+            item = self.loaded.setdefault(barcode, item)
+        return item
+
+    def __setitem__(self, barcode, item):
+        self.loaded[barcode] = item
+        self.positions.setdefault(barcode, None)
+
+    def __delitem__(self, barcode):
+        del self.positions[barcode]
+        self.loaded.pop(barcode, None)
+
+    def __contains__(self, barcode):
+        return barcode in self.positions
+
+    def __iter__(self):
+        return iter(self.positions)
+
+    def __len__(self):
+        return len(self.positions)
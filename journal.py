@@ -0,0 +1,228 @@
+import glob
+import json
+import os
+import threading
+import uuid
+from datetime import datetime
+from locks import FileLock
+
+
+class SalesJournal:
+    """Append-only log of completed sales, kept next to the monthly Excel file."""
+
+    SUFFIX = ".journal"
+
+    def __init__(self, excel_handler):
+        self.excel_handler = excel_handler
+        self.lock = threading.Lock()
+
+    def get_journal_path(self):
+        """Journal file that belongs to the current Excel file."""
+        return os.path.splitext(self.excel_handler.file_path)[0] + self.SUFFIX
+
+    def get_append_path(self):
+        """Journal for new sales, which always belong to the current month."""
+        if self.excel_handler.auto_rollover:
+            excel_path = self.excel_handler.get_excel_path()
+        else:
+            excel_path = self.excel_handler.file_path
+        return os.path.splitext(excel_path)[0] + self.SUFFIX
+
+    def get_compacting_path(self, batch):
+        """Journal file of a batch that is being folded into the workbook.
+
+        The batch id in its name is recorded by the storage together with the
+        stock it took off, so a batch is never applied twice.
+        """
+        return f"{self.get_journal_path()}.{batch}.compacting"
+
+    def get_batch(self, compacting_path):
+        return compacting_path.rsplit(".", 2)[1]
+
+    def get_lock_path(self, journal_path):
+        """FileLock path of a journal, taken to append to it or move it aside."""
+        return journal_path + ".lock"
+
+    def append(self, records):
+        """Write the records and fsync so the sale survives a crash."""
+        lines = "".join(json.dumps(record) + "\n" for record in records)
+        with self.lock:
+            path = self.get_append_path()
+            with FileLock(self.get_lock_path(path)):
+                with open(path, "a", encoding="utf-8") as f:
+                    f.write(lines)
+                    f.flush()
+                    os.fsync(f.fileno())
+
+    def begin_compaction(self):
+        """Move pending records aside as a new batch and return its path.
+
+        Returns None if idle. Call it with the workbook's FileLock held, so
+        no other process claims or applies the same batch meanwhile.
+        """
+        with self.lock:
+            journal_path = self.get_journal_path()
+            # A leftover file means the last compaction never finished
+            leftovers = sorted(glob.glob(glob.escape(journal_path) + ".*.compacting"))
+            if leftovers:
+                return leftovers[0]
+            # Written before batches had ids; it gets one now
+            if os.path.exists(journal_path + ".compacting"):
+                journal_path += ".compacting"
+            elif not os.path.exists(journal_path) or os.path.getsize(journal_path) == 0:
+                return None
+            compacting_path = self.get_compacting_path(uuid.uuid4().hex[:12])
+            # Another process may be appending; its sale must not land in a
+            # batch that is already being applied
+            with FileLock(self.get_lock_path(self.get_journal_path())):
+                os.replace(journal_path, compacting_path)
+            return compacting_path
+
+    def pending_records(self):
+        """Records not yet taken off the stock: the journal and unfinished batches.
+
+        Call it with the workbook's FileLock held, so no batch is half applied.
+        """
+        journal_path = self.get_journal_path()
+        paths = {journal_path, self.get_append_path(), journal_path + ".compacting"}
+        paths.update(glob.glob(glob.escape(journal_path) + ".*.compacting"))
+        records = []
+        # No append is half written while the journals are read
+        with self.lock, FileLock(self.get_lock_path(journal_path)), FileLock(
+            self.get_lock_path(self.get_append_path())
+        ):
+            for path in sorted(paths):
+                if os.path.exists(path):
+                    records.extend(self.read_records(path))
+        return records
+
+    def get_archive_path(self):
+        """Sales of the current month that are already in the workbook."""
+        return os.path.splitext(self.excel_handler.file_path)[0] + ".sales.jsonl"
+
+    def archive(self, records, batch=None):
+        """Keep compacted records, with their prices, for the profit reports."""
+        if batch is not None:
+            records = [dict(record, batch=batch) for record in records]
+        lines = "".join(json.dumps(record) + "\n" for record in records)
+        with open(self.get_archive_path(), "a", encoding="utf-8") as f:
+            f.write(lines)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def is_archived(self, batch):
+        """Whether a batch's records already made it into the archive."""
+        path = self.get_archive_path()
+        if not os.path.exists(path):
+            return False
+        marker = json.dumps({"batch": batch})[1:-1]
+        with open(path, encoding="utf-8") as f:
+            return any(marker in line for line in f)
+
+    def finish_compaction(self, compacting_path):
+        """Forget records that are now stored in the workbook."""
+        os.remove(compacting_path)
+
+    def read_records(self, path):
+        """Read records, skipping a line torn by a power loss."""
+        records = []
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    print(f"Skipping damaged journal line: {line!r}")
+        return records
+
+
+class JournalCompactor(threading.Thread):
+    """Background thread that folds journaled sales into the Excel file."""
+
+    def __init__(self, journal, apply_sale, interval=5.0):
+        super().__init__(daemon=True)
+        self.journal = journal
+        self.apply_sale = apply_sale
+        self.interval = interval
+        self.wakeup = threading.Event()
+        self.stopping = False
+        # compact() may also be called directly, e.g. from the benchmark
+        self.compact_lock = threading.Lock()
+
+    def run(self):
+        # The first pass replays anything left over from the previous run
+        while True:
+            try:
+                self.journal.excel_handler.ensure_current_month()
+                self.compact()
+            except Exception as e:
+                print(f"Error compacting sales journal: {e}")
+            if self.stopping:
+                return
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+
+    def schedule(self):
+        """Ask for a compaction soon instead of waiting for the interval."""
+        self.wakeup.set()
+
+    def stop(self):
+        """Compact whatever is left and end the thread."""
+        self.stopping = True
+        self.wakeup.set()
+        self.join()
+
+    def compact(self):
+        """Apply every pending record to the workbook with one save per batch."""
+        # Same lock order as a month rollover, which compacts while holding
+        # the ExcelHandler write lock
+        excel_handler = self.journal.excel_handler
+        with excel_handler.write_lock, self.compact_lock, FileLock(
+            excel_handler.get_lock_path()
+        ):
+            while True:
+                path = self.journal.begin_compaction()
+                if path is None:
+                    return
+                self.apply_batch(path)
+                self.journal.finish_compaction(path)
+
+    def apply_batch(self, path):
+        """Apply and archive one claimed batch unless that was done before.
+
+        A batch left by a crash may already be in the workbook; the storage
+        then skips it, and it is archived only if the crash came before that.
+        """
+        batch = self.journal.get_batch(path)
+        records = self.journal.read_records(path)
+        cart = {}
+        for record in records:
+            barcode = record["barcode"]
+            cart[barcode] = cart.get(barcode, 0) + int(record["qty"])
+
+        if self.apply_sale(cart, batch) or not self.journal.is_archived(batch):
+            self.journal.archive(records, batch)
+        return records
+
+
+def replay_journal(excel_handler):
+    """Fold a month's leftover journal into its storage, synchronously."""
+    journal = SalesJournal(excel_handler)
+    JournalCompactor(journal, excel_handler.storage.apply_sale).compact()
+
+
+def make_sale_records(cart, prices, costs=None, timestamp=None, discounts=None):
+    """Build one journal record per cart line, stamped with the sale time."""
+    timestamp = timestamp or datetime.now().isoformat(timespec="seconds")
+    costs = costs or {}
+    discounts = discounts or {}
+    return [
+        {
+            "timestamp": timestamp,
+            "barcode": barcode,
+            "qty": qty,
+            "price": prices.get(barcode),
+            "cost": costs.get(barcode),
+            "discount": discounts.get(barcode, 0),
+        }
+        for barcode, qty in cart.items()
+    ]
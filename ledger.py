@@ -0,0 +1,190 @@
+"""Sales ledger split into a retail and a business partition.
+
+Each partition has its own journal and compactor thread. Both fold their
+sales into the one stock in the monthly workbook, a batch per save, so stock
+stays right however an item leaves the shop. Business (wholesale) orders are
+also written to their own workbook, POS_YYYY_MM_business.xlsx, outside the
+monthly file's lock, so a large order never holds up the tills.
+"""
+
+import glob
+import os
+import threading
+import time
+from journal import JournalCompactor, SalesJournal, replay_journal
+from locks import FileLock
+
+RETAIL = "retail"
+BUSINESS = "business"
+
+BUSINESS_SHEET = "Business Sales"
+BUSINESS_HEADERS = [
+    "Order",
+    "Date",
+    "Customer",
+    "Barcode",
+    "Item Name",
+    "Quantity",
+    "Price",
+    "Discount",
+    "Total",
+]
+
+
+class BusinessJournal(SalesJournal):
+    """Journal of business orders, next to the retail one."""
+
+    SUFFIX = ".business.journal"
+
+    def get_ledger_path(self):
+        return os.path.splitext(self.excel_handler.file_path)[0] + "_business.xlsx"
+
+    def stage(self, compacting_path, ledger_path):
+        """Hand a batch whose stock is applied over to the ledger writer.
+
+        The file name carries the ledger it belongs to, so a batch staged
+        before a month rollover still goes to last month's ledger.
+        """
+        base = os.path.splitext(ledger_path)[0]
+        os.replace(compacting_path, f"{base}.{time.time_ns()}.pending")
+
+    def staged_paths(self):
+        folder = os.path.dirname(self.excel_handler.file_path) or "."
+        return sorted(glob.glob(os.path.join(folder, "*_business.*.pending")))
+
+
+class BusinessCompactor(JournalCompactor):
+    """Applies business orders to stock, then writes them to the ledger.
+
+    The stock step holds the monthly file's lock like a retail compaction.
+    The ledger step does not: it only locks the business workbook. Orders
+    already in the ledger are skipped, so a batch interrupted after its rows
+    were saved is not written twice.
+    """
+
+    def __init__(self, journal, apply_sale, interval=5.0):
+        super().__init__(journal, apply_sale, interval)
+        # Serializes ledger writes without holding up stock compactions
+        self.ledger_lock = threading.Lock()
+
+    def compact(self):
+        journal = self.journal
+        excel_handler = journal.excel_handler
+        with excel_handler.write_lock, self.compact_lock, FileLock(
+            excel_handler.get_lock_path()
+        ):
+            while True:
+                path = journal.begin_compaction()
+                if path is None:
+                    break
+                self.apply_batch(path)
+                journal.stage(path, journal.get_ledger_path())
+
+        with self.ledger_lock:
+            for path in journal.staged_paths():
+                ledger_path = path.rsplit(".", 2)[0] + ".xlsx"
+                with FileLock(ledger_path + ".lock") as lock:
+                    # Another process may have written this batch meanwhile
+                    if not os.path.exists(path):
+                        continue
+                    self.write_ledger(ledger_path, journal.read_records(path), lock)
+                    journal.finish_compaction(path)
+
+    def write_ledger(self, path, records, lock):
+        """Append records to the ledger at path; lock is its FileLock, held."""
+        excel_handler = self.journal.excel_handler
+        if os.path.exists(path):
+            from openpyxl import load_workbook
+
+            wb = load_workbook(path)
+            ws = wb[BUSINESS_SHEET]
+        else:
+            from openpyxl import Workbook
+
+            wb = Workbook()
+            ws = wb.active
+            ws.title = BUSINESS_SHEET
+            ws.append(BUSINESS_HEADERS)
+            for cell in ws[1]:
+                excel_handler.apply_formatting(cell, "header")
+
+        written = {
+            order for (order,) in ws.iter_rows(min_row=2, max_col=1, values_only=True)
+        }
+        rows = [
+            [
+                record["order"],
+                record["timestamp"],
+                record.get("customer"),
+                record["barcode"],
+                record.get("name"),
+                record["qty"],
+                record["price"],
+                record["discount"],
+                (record["price"] or 0) * record["qty"] - record["discount"],
+            ]
+            for record in records
+            if record["order"] not in written
+        ]
+        if not rows:
+            return
+        for values in rows:
+            ws.append(values)
+            for cell in ws[ws.max_row]:
+                excel_handler.apply_formatting(cell, "data")
+        wb.save(path)
+        lock.write_version(lock.read_version() + 1)
+        excel_handler.take_snapshot(wb, path)
+
+
+class SalesLedger:
+    """Retail and business sales, each journaled and compacted on its own."""
+
+    def __init__(self, excel_handler, apply_sale):
+        retail = SalesJournal(excel_handler)
+        business = BusinessJournal(excel_handler)
+        self.partitions = {
+            RETAIL: (retail, JournalCompactor(retail, apply_sale)),
+            BUSINESS: (business, BusinessCompactor(business, apply_sale)),
+        }
+        for _journal, compactor in self.partitions.values():
+            # Last month's sales must be in its file before stock is carried over
+            excel_handler.rollover_callbacks.append(compactor.compact)
+            compactor.start()
+
+    def journal(self, partition):
+        return self.partitions[partition][0]
+
+    def compactor(self, partition):
+        return self.partitions[partition][1]
+
+    def record(self, partition, records):
+        """Journal records durably; the partition's compactor applies them soon."""
+        journal, compactor = self.partitions[partition]
+        journal.append(records)
+        compactor.schedule()
+
+    def pending_quantities(self):
+        """{barcode: quantity} journaled in either partition but not yet applied."""
+        pending = {}
+        for journal, _compactor in self.partitions.values():
+            for record in journal.pending_records():
+                barcode = record["barcode"]
+                pending[barcode] = pending.get(barcode, 0) + int(record["qty"])
+        return pending
+
+    def compact(self):
+        """Apply every pending sale of both partitions now."""
+        for _journal, compactor in self.partitions.values():
+            compactor.compact()
+
+    def close(self):
+        for _journal, compactor in self.partitions.values():
+            compactor.stop()
+
+
+def replay_ledger(excel_handler):
+    """Fold a month's leftover retail and business sales into its storage."""
+    replay_journal(excel_handler)
+    journal = BusinessJournal(excel_handler)
+    BusinessCompactor(journal, excel_handler.storage.apply_sale).compact()
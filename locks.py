@@ -0,0 +1,118 @@
+import os
+import threading
+import time
+
+if os.name == "nt":
+    import msvcrt
+else:
+    import fcntl
+
+# How long a writer waits for another process's turn. A load and save of a
+# 50k-row workbook takes about 14 s, and a month file is created from the
+# whole inventory, so leave room for a few of them in a row
+DEFAULT_TIMEOUT = 120.0
+
+
+class FileLock:
+    """Advisory lock shared by every process that writes the same workbook.
+
+    The lock file also holds a write counter. Each writer bumps it after a
+    save, so a process can tell whether its cached copy is still the latest
+    one even when the file's mtime and size happen to match.
+
+    A thread that already holds the lock may take it again, e.g. a compaction
+    that holds it around a workbook write; it is released with the outermost
+    holder. Other threads wait like other processes do. With reentrant=False
+    every holder is exclusive, even within one thread.
+    """
+
+    # abspath -> [file, owning thread, depth] for locks held in this process
+    held = {}
+    held_lock = threading.Lock()
+
+    def __init__(self, path, timeout=DEFAULT_TIMEOUT, reentrant=True):
+        self.path = path
+        self.timeout = timeout
+        self.reentrant = reentrant
+        self.file = None
+
+    def acquire(self):
+        key = os.path.abspath(self.path)
+        if not self.reentrant:
+            key = None
+        with self.held_lock:
+            entry = self.held.get(key)
+            if entry is not None and entry[1] == threading.get_ident():
+                entry[2] += 1
+                self.file = entry[0]
+                return self
+
+        self.file = open(self.path, "a+b")
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                self.lock_file()
+                break
+            except OSError:
+                if time.monotonic() >= deadline:
+                    self.file.close()
+                    self.file = None
+                    raise TimeoutError(f"Timed out waiting for {self.path}")
+                time.sleep(0.05)
+        if key is not None:
+            with self.held_lock:
+                self.held[key] = [self.file, threading.get_ident(), 1]
+        return self
+
+    def release(self):
+        if self.file is None:
+            return
+        if self.reentrant:
+            key = os.path.abspath(self.path)
+            with self.held_lock:
+                entry = self.held[key]
+                entry[2] -= 1
+                if entry[2] > 0:
+                    self.file = None
+                    return
+                del self.held[key]
+        try:
+            self.unlock_file()
+        finally:
+            self.file.close()
+            self.file = None
+
+    def lock_file(self):
+        if os.name == "nt":
+            self.file.seek(0)
+            msvcrt.locking(self.file.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+    def unlock_file(self):
+        if os.name == "nt":
+            self.file.seek(0)
+            msvcrt.locking(self.file.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+
+    def read_version(self):
+        """Return the write counter (0 for a new lock file)."""
+        self.file.seek(0)
+        try:
+            return int(self.file.read().decode().strip() or 0)
+        except ValueError:
+            return 0
+
+    def write_version(self, version):
+        self.file.seek(0)
+        self.file.truncate()
+        self.file.write(str(version).encode())
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
@@ -1,9 +1,64 @@
+import time
+
+STARTED_AT = time.perf_counter()
+
+import os
 import sys
+from PyQt6.QtCore import QTimer
 from PyQt6.QtWidgets import QApplication
-from GUI.main_gui import MainApp
 
-if __name__ == "__main__":
+
+class StartupTimer:
+    """Print how long each startup stage took."""
+
+    def __init__(self, started_at):
+        self.started_at = started_at
+        self.last = started_at
+
+    def stage(self, name):
+        now = time.perf_counter()
+        print(f"[startup] {name}: {(now - self.last) * 1000:.0f} ms")
+        self.last = now
+
+    def total(self, name):
+        now = time.perf_counter()
+        print(f"[startup] {name}: {(now - self.started_at) * 1000:.0f} ms total")
+
+
+def main():
+    timer = StartupTimer(STARTED_AT)
+    timer.stage("import Qt")
+
     app = QApplication(sys.argv)
-    window = MainApp()
+    timer.stage("create QApplication")
+
+    from GUI.main_gui import MainApp
+
+    timer.stage("import app modules")
+
+    # POS_SERVICE=host:port makes this till a client of the inventory service
+    service_address = os.environ.get("POS_SERVICE")
+    if service_address:
+        from service import InventoryClient
+
+        window_args = {"client": InventoryClient.from_address(service_address)}
+    else:
+        from excel import ExcelHandler
+
+        window_args = {"excel_handler": ExcelHandler()}
+    timer.stage("open storage")
+
+    window = MainApp(**window_args)
+    timer.stage("build main window")
+
     window.show()
+    timer.stage("show window")
+
+    # Runs once the event loop is idle, i.e. when the till can take a scan
+    QTimer.singleShot(0, lambda: timer.total("ready to scan"))
+    QTimer.singleShot(0, window.warm_up)
     sys.exit(app.exec())
+
+
+if __name__ == "__main__":
+    main()
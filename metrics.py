@@ -0,0 +1,155 @@
+import functools
+import glob
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from logging.handlers import RotatingFileHandler
+
+METRICS_PATH = os.path.join("data", "metrics.log")
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(
+        0, min(len(sorted_values) - 1, round(pct / 100 * len(sorted_values)) - 1)
+    )
+    return sorted_values[rank]
+
+
+def summarize(samples):
+    """Count and p50/p95/p99/max in ms for each operation."""
+    summary = {}
+    for name, values in sorted(samples.items()):
+        values = sorted(values)
+        summary[name] = {
+            "count": len(values),
+            "p50_ms": round(percentile(values, 50), 3),
+            "p95_ms": round(percentile(values, 95), 3),
+            "p99_ms": round(percentile(values, 99), 3),
+            "max_ms": round(values[-1], 3),
+        }
+    return summary
+
+
+def format_summary(summary):
+    lines = [f"{'operation':<36}{'count':>8}{'p50':>10}{'p95':>10}{'p99':>10}"]
+    for name, stats in summary.items():
+        lines.append(
+            f"{name:<36}{stats['count']:>8}{stats['p50_ms']:>10.1f}"
+            f"{stats['p95_ms']:>10.1f}{stats['p99_ms']:>10.1f}"
+        )
+    return "\n".join(lines)
+
+
+class Metrics:
+    """Rolling latency histograms per operation plus a rotating metrics file."""
+
+    def __init__(self, path=METRICS_PATH, window=1000):
+        self.path = path
+        self.window = window
+        self.samples = {}
+        self.lock = threading.Lock()
+        self.logger = None
+        # Set POS_METRICS=0 to keep timings in memory only
+        self.write_file = os.environ.get("POS_METRICS", "1") != "0"
+
+    def get_logger(self):
+        """Open the metrics file on first use."""
+        if self.logger is None:
+            logger = logging.getLogger("pos.metrics")
+            logger.propagate = False
+            logger.setLevel(logging.INFO)
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            handler = RotatingFileHandler(
+                self.path, maxBytes=1_000_000, backupCount=3, encoding="utf-8"
+            )
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            logger.addHandler(handler)
+            self.logger = logger
+        return self.logger
+
+    def record(self, name, ms):
+        with self.lock:
+            if name not in self.samples:
+                self.samples[name] = deque(maxlen=self.window)
+            self.samples[name].append(ms)
+            if not self.write_file:
+                return
+            try:
+                logger = self.get_logger()
+            except OSError as e:
+                print(f"Error opening metrics file: {e}")
+                self.write_file = False
+                return
+        try:
+            logger.info(
+                json.dumps(
+                    {"ts": round(time.time(), 3), "op": name, "ms": round(ms, 3)}
+                )
+            )
+        except OSError as e:
+            print(f"Error writing metrics: {e}")
+
+    @contextmanager
+    def span(self, name):
+        """Time the body of a with-block under `name`."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, (time.perf_counter() - start) * 1000)
+
+    def timed(self, name):
+        """Decorator form of span()."""
+
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.span(name):
+                    return fn(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def reset(self):
+        """Forget the in-memory samples."""
+        with self.lock:
+            self.samples.clear()
+
+    def summary(self):
+        """Percentiles over the last `window` samples of each operation."""
+        with self.lock:
+            samples = {name: list(values) for name, values in self.samples.items()}
+        return summarize(samples)
+
+
+metrics = Metrics()
+span = metrics.span
+timed = metrics.timed
+
+
+def read_metrics_files(path=METRICS_PATH):
+    """Collect samples from the metrics file and its rotated backups."""
+    samples = {}
+    for file_path in sorted(glob.glob(path + "*")):
+        with open(file_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                samples.setdefault(record["op"], []).append(record["ms"])
+    return samples
+
+
+if __name__ == "__main__":
+    # python metrics.py [metrics.log] prints the p50/p95/p99 table
+    print(format_summary(summarize(read_metrics_files(*sys.argv[1:2]))))
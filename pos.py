@@ -1,40 +1,147 @@
-import pandas as pd
-from openpyxl import load_workbook
+import os
+import uuid
 from excel import ExcelHandler
+from metrics import timed
+from journal import make_sale_records
+from ledger import BUSINESS, RETAIL, SalesLedger
+from locks import FileLock
+from prices import now
 
 
 class POSHandler:
-    def __init__(self):
-        self.excel_handler = ExcelHandler()
+    def __init__(self, excel_handler=None):
+        # Share one ExcelHandler between handlers so the file is set up once
+        self.excel_handler = excel_handler or ExcelHandler()
+        self.storage = self.excel_handler.storage
+        # Retail and business sales are journaled and compacted separately
+        self.ledger = SalesLedger(self.excel_handler, self.commit_sale)
+        self.journal = self.ledger.journal(RETAIL)
+        self.compactor = self.ledger.compactor(RETAIL)
+        self.discounts = None
+        self.discounts_version = None
 
+    @timed("pos.find_item_by_barcode")
     def find_item_by_barcode(self, barcode):
-        # Using pandas to search for the barcode in the Excel sheet
-        df = pd.read_excel(
-            self.excel_handler.file_path, dtype={"Barcode": str}, engine="openpyxl"
-        )
-        # Look for the item in the dataframe
-        item = df[df["Barcode"] == barcode]
-        if not item.empty:
-            return item.iloc[0].to_dict()  # Return the first match
-        else:
-            return None
-
-    def update_inventory(self, item_name):
+        # Backed by a cached index or an indexed column, never a full re-read
+        return self.storage.find_item(barcode)
+
+    def get_items(self):
+        """Every item as a barcode -> item dict, e.g. for the search index."""
+        return self.storage.get_items()
+
+    @timed("pos.get_discounts")
+    def get_discounts(self):
+        """Discount rules from the sheet next to the monthly file.
+
+        The sheet is re-read only when it changes (or appears/disappears).
+        """
+        from discounts import DISCOUNTS_FILE, load_discount_rules
+
+        data_dir = os.path.dirname(self.excel_handler.file_path) or "."
+        path = os.path.join(data_dir, DISCOUNTS_FILE)
+        version = os.stat(path).st_mtime_ns if os.path.exists(path) else None
+        if self.discounts is None or version != self.discounts_version:
+            self.discounts = load_discount_rules(path)
+            self.discounts_version = version
+        return self.discounts
+
+    @timed("pos.update_inventory")
+    def update_inventory(self, barcode, quantity=1):
         """Update the inventory by reducing the quantity of the sold item."""
-        wb = self.excel_handler.load_workbook()
-        ws = wb.active
+        self.commit_sale({barcode: quantity})
+
+    @timed("pos.commit_sale")
+    def commit_sale(self, cart, batch=None):
+        """Apply a whole cart of {barcode: quantity} in one transaction.
+
+        Returns False if the journal batch was already applied.
+        """
+        return self.storage.apply_sale(cart, batch)
 
-        columns = self.excel_handler.get_column_indexes(ws)
+    @timed("pos.record_sale")
+    def record_sale(self, cart, discounts=None):
+        """Journal a cart of {barcode: quantity}; the workbook is updated later.
 
-        # Search for the item in the "Item Name" column
-        for row in range(2, ws.max_row + 1):  # Start from row 2 (skip headers)
-            if ws.cell(row=row, column=columns["Item Name"]).value == item_name:
-                inventory_cell = ws.cell(row=row, column=columns["Inventory Quantity"])
+        discounts maps barcode -> amount taken off that line, if any.
+        """
+        if not cart:
+            return
+        self.ledger.record(RETAIL, self.make_records(cart, discounts))
+
+    @timed("pos.record_business_sale")
+    def record_business_sale(self, cart, customer, discounts=None):
+        """Journal a wholesale order; it goes to the business ledger.
+
+        The order is refused if a line asks for more than the stock on
+        record, less the sales journaled but not yet applied, since a bulk
+        order can easily empty a shelf. The month's file lock is held until
+        the order is journaled, so orders from any till are checked in turn
+        and each one sees the ones before it.
+        """
+        if not cart:
+            return
+
+        # Roll over first: that takes the new month's lock before the old one
+        self.excel_handler.ensure_current_month()
+        # Same lock order as a compaction
+        with self.excel_handler.write_lock, FileLock(
+            self.excel_handler.get_lock_path()
+        ):
+            pending = self.ledger.pending_quantities()
+            names = {}
+            short = []
+            for barcode, qty in cart.items():
+                item = self.storage.find_item(barcode)
+                if item is None:
+                    raise ValueError(f"Unknown barcode: {barcode}")
+                names[barcode] = item["Item Name"]
+                stock = (item["Inventory Quantity"] or 0) - pending.get(barcode, 0)
+                if qty > stock:
+                    short.append(f"{item['Item Name']} ({max(stock, 0)} left)")
+            if short:
+                raise ValueError(f"Not enough stock for {', '.join(short)}")
+
+            records = self.make_records(cart, discounts)
+            order = uuid.uuid4().hex[:12]
+            for record in records:
+                record.update(
+                    channel=BUSINESS,
+                    order=order,
+                    customer=customer,
+                    name=names[record["barcode"]],
+                )
+            self.ledger.record(BUSINESS, records)
+
+    def make_records(self, cart, discounts=None):
+        """Journal records with each line priced as it was at this moment."""
+        timestamp = now()
+        price_history = self.excel_handler.get_price_history()
+        prices = {}
+        costs = {}
+        for barcode in cart:
+            history_prices = price_history.price_at(barcode, timestamp)
+            if history_prices is not None:
+                costs[barcode], prices[barcode] = history_prices
+                continue
+            item = self.storage.find_item(barcode)
+            if item is not None:
                 try:
-                    current_quantity = int(inventory_cell.value)
-                except (ValueError, TypeError):
-                    current_quantity = 0
-                inventory_cell.value = max(0, current_quantity - 1)
-                break
+                    prices[barcode] = float(item["Sale Price"])
+                except (TypeError, ValueError):
+                    raise ValueError(
+                        f"{item['Item Name'] or barcode} has no sale price"
+                    )
+                costs[barcode] = float(item["Original Price"] or 0)
+        return make_sale_records(cart, prices, costs, timestamp, discounts)
+
+    def subscribe_stock(self, callback):
+        """Call callback({barcode: quantity left}) whenever stock changes.
+
+        It runs on whichever thread committed the change.
+        """
+        self.excel_handler.stock_callbacks.append(callback)
 
-        self.excel_handler.save_workbook(wb)
+    def close(self):
+        """Fold any journaled sales into storage before exiting."""
+        self.ledger.close()
+        self.storage.close()
@@ -0,0 +1,150 @@
+import json
+import os
+import threading
+from bisect import bisect_right
+from datetime import datetime
+
+HISTORY_FILE = "price_history.jsonl"
+
+# Effective date for the prices an item had before history was kept
+BEGINNING = "0001-01-01T00:00:00"
+
+
+def now():
+    return datetime.now().isoformat(timespec="seconds")
+
+
+class PriceHistory:
+    """Append-only log of price changes with a per-barcode binary-search index.
+
+    Each record says which cost and sale price apply to a barcode from
+    `effective_from` on. Timestamps are ISO strings, which sort in time order.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        # barcode -> (sorted effective_from list, matching (original, sale) list)
+        self.index = {}
+        # Bytes of the file already in the index, and the file's (mtime, size)
+        # when it was last read
+        self.offset = 0
+        self.version = None
+        with self.lock:
+            self.refresh()
+
+    def refresh(self):
+        """Index records appended since the last read, by any process.
+
+        Call it with the lock held. Costs one stat while the file is unchanged,
+        like the discount sheet check.
+        """
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        version = (stat.st_mtime_ns, stat.st_size)
+        if version == self.version:
+            return
+        if stat.st_size < self.offset:
+            # Replaced rather than appended to; read it again from the start
+            self.index = {}
+            self.offset = 0
+        with open(self.path, "rb") as f:
+            f.seek(self.offset)
+            data = f.read()
+        # A line another process is still writing is read next time
+        end = data.rfind(b"\n") + 1
+        records = []
+        for line in data[:end].decode("utf-8").splitlines():
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                print(f"Skipping damaged price history line: {line!r}")
+        self.offset += end
+        self.version = version
+        # Appends are in time order, but a clock change could break that
+        records.sort(key=lambda record: record["effective_from"])
+        for record in records:
+            self.add_to_index(record)
+
+    def add_to_index(self, record):
+        times, prices = self.index.setdefault(record["barcode"], ([], []))
+        i = bisect_right(times, record["effective_from"])
+        times.insert(i, record["effective_from"])
+        prices.insert(i, (record["original_price"], record["sale_price"]))
+
+    def price_at(self, barcode, when=None):
+        """Return (original price, sale price) in effect at `when`, or None."""
+        with self.lock:
+            self.refresh()
+            entry = self.index.get(str(barcode))
+            if entry is None:
+                return None
+            times, prices = entry
+            i = bisect_right(times, when or now())
+            return prices[i - 1] if i else None
+
+    def record_changes(self, items, old_items, when=None):
+        """Log the new prices of items whose prices differ from what applies now.
+
+        old_items maps barcode -> the item as stored before the update; its
+        prices are logged as the starting point for barcodes without history.
+        """
+        when = when or now()
+        records = []
+        with self.lock:
+            self.refresh()
+            for item in items:
+                barcode = str(item["Barcode"])
+                new_prices = (
+                    float(item["Original Price"]),
+                    float(item["Sale Price"]),
+                )
+                entry = self.index.get(barcode)
+                if entry:
+                    current = entry[1][-1]
+                else:
+                    current = None
+                    old = old_items.get(barcode)
+                    if old and old.get("Sale Price") is not None:
+                        current = (
+                            float(old.get("Original Price") or 0),
+                            float(old["Sale Price"]),
+                        )
+                        records.append(self.make_record(barcode, current, BEGINNING))
+                if current != new_prices:
+                    records.append(self.make_record(barcode, new_prices, when))
+
+            if not records:
+                return
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write("".join(json.dumps(record) + "\n" for record in records))
+                f.flush()
+                os.fsync(f.fileno())
+            # Picks up our records along with any appended meanwhile
+            self.refresh()
+
+    def make_record(self, barcode, prices, when):
+        return {
+            "barcode": barcode,
+            "effective_from": when,
+            "original_price": prices[0],
+            "sale_price": prices[1],
+        }
+
+    def to_frame(self):
+        """All records as a DataFrame, for pandas.merge_asof in the reports."""
+        import pandas as pd
+
+        with self.lock:
+            self.refresh()
+            rows = [
+                (barcode, effective_from, original_price, sale_price)
+                for barcode, (times, prices) in self.index.items()
+                for effective_from, (original_price, sale_price) in zip(times, prices)
+            ]
+        return pd.DataFrame(
+            rows,
+            columns=["barcode", "effective_from", "original_price", "sale_price"],
+        )
@@ -0,0 +1,277 @@
+import argparse
+import glob
+import os
+import re
+from excel import MONTH_FILE_PATTERN
+from metrics import timed
+from prices import BEGINNING, HISTORY_FILE, PriceHistory
+
+# The columns the report needs, renamed to short identifiers
+REPORT_COLUMNS = {
+    "Barcode": "barcode",
+    "Item Name": "item_name",
+    "Inventory Quantity": "inventory",
+    "Quantity Sold": "sold",
+    "Original Price": "original_price",
+    "Sale Price": "sale_price",
+}
+
+
+# Part of every cached month's version; bump it when compute_month changes
+CACHE_FORMAT = 2
+
+
+def parse_month(value):
+    """'2025-03', '2025_03' or '202503' -> (2025, 3)."""
+    match = re.fullmatch(r"(\d{4})[-_]?(\d{2})", str(value))
+    if not match:
+        raise ValueError(f"Month must look like YYYY-MM: {value}")
+    return int(match.group(1)), int(match.group(2))
+
+
+def month_of(path):
+    """(year, month) of a POS_YYYY_MM.xlsx path."""
+    return parse_month(os.path.basename(path)[4:11])
+
+
+def get_sales_path(path):
+    """Archived sales records that belong to a monthly workbook."""
+    return os.path.splitext(path)[0] + ".sales.jsonl"
+
+
+def get_mtime(path):
+    return os.stat(path).st_mtime_ns if os.path.exists(path) else None
+
+
+class ProfitReport:
+    """Profit figures across monthly files, computed with pandas.
+
+    The profit columns in the workbook are formulas that openpyxl never
+    evaluates, so they are recomputed here from quantities and prices.
+    Archived sales are valued at the cost and price that applied when they
+    were made; only sales from before the archive use the workbook prices.
+    Each month's frame is cached in memory and on disk and reused until the
+    workbook, its sales archive or the price history changes.
+    """
+
+    def __init__(self, data_dir="data", cache_dir=None):
+        self.data_dir = data_dir
+        self.cache_dir = cache_dir or os.path.join(data_dir, ".report_cache")
+        self.history_path = os.path.join(data_dir, HISTORY_FILE)
+        self.months = {}
+
+    def month_files(self, start=None, end=None):
+        """Monthly workbooks between start and end (inclusive), oldest first."""
+        start = parse_month(start) if start else (0, 0)
+        end = parse_month(end) if end else (9999, 12)
+        paths = [
+            path
+            for path in glob.glob(os.path.join(self.data_dir, "POS_*.xlsx"))
+            if MONTH_FILE_PATTERN.match(os.path.basename(path))
+        ]
+        return sorted(path for path in paths if start <= month_of(path) <= end)
+
+    def load_month(self, path):
+        """Per-item figures for one month, from cache when the file is unchanged."""
+        import pandas as pd
+
+        version = (
+            CACHE_FORMAT,
+            os.stat(path).st_mtime_ns,
+            get_mtime(get_sales_path(path)),
+            get_mtime(self.history_path),
+        )
+        cached = self.months.get(path)
+        if cached and cached[0] == version:
+            return cached[1]
+
+        cache_path = os.path.join(
+            self.cache_dir, os.path.basename(path).replace(".xlsx", ".pkl")
+        )
+        frame = None
+        if os.path.exists(cache_path):
+            try:
+                cached_version, frame = pd.read_pickle(cache_path)
+                if cached_version != version:
+                    frame = None
+            except Exception as e:
+                print(f"Ignoring report cache {cache_path}: {e}")
+                frame = None
+
+        if frame is None:
+            frame = self.compute_month(path)
+            os.makedirs(self.cache_dir, exist_ok=True)
+            pd.to_pickle((version, frame), cache_path)
+
+        self.months[path] = (version, frame)
+        return frame
+
+    @timed("reports.compute_month")
+    def compute_month(self, path):
+        """Read one workbook and derive profit columns for every item row."""
+        import pandas as pd
+
+        df = pd.read_excel(path, dtype={"Barcode": str}, engine="openpyxl")
+        df = df[[col for col in REPORT_COLUMNS if col in df.columns]]
+        df = df.rename(columns=REPORT_COLUMNS)
+        df = df[df["barcode"].notna()].copy()
+        for col in ("inventory", "sold", "original_price", "sale_price"):
+            if col not in df.columns:
+                df[col] = float("nan")
+            df[col] = pd.to_numeric(df[col], errors="coerce")
+
+        # Sales are taken off Inventory Quantity, so it is the stock left;
+        # Quantity Left only mirrors it and is blank in older files
+        df["left"] = df["inventory"]
+        df[["inventory", "sold", "left"]] = df[["inventory", "sold", "left"]].fillna(0)
+        df[["original_price", "sale_price"]] = df[
+            ["original_price", "sale_price"]
+        ].fillna(0)
+
+        year, month = month_of(path)
+        df["month"] = f"{year}-{month:02d}"
+
+        # Units sold before the sales archive existed only have today's prices
+        sales = self.load_sales(path, df)
+        if sales is None:
+            df["revenue"] = 0.0
+            df["cost"] = 0.0
+            df["archived"] = 0
+        else:
+            df = df.join(sales, on="barcode")
+            df[["revenue", "cost", "archived"]] = df[
+                ["revenue", "cost", "archived"]
+            ].fillna(0)
+        unarchived = (df["sold"] - df["archived"]).clip(lower=0)
+
+        # Same definitions as the workbook formulas
+        df["total_profit"] = df["revenue"] + df["sale_price"] * unarchived
+        df["invested"] = df["inventory"] * df["original_price"]
+        df["clean_profit"] = df["total_profit"] - df["invested"]
+        # Profit on the units that actually sold
+        df["cost_of_sold"] = df["cost"] + df["original_price"] * unarchived
+        df["gross_profit"] = df["total_profit"] - df["cost_of_sold"]
+        df = df.drop(columns=["revenue", "cost", "archived"])
+        return df.reset_index(drop=True)
+
+    def load_sales(self, path, items):
+        """Revenue, cost and units per barcode from the month's sales archive.
+
+        Revenue is net of the discount given on the line. Records without a
+        price or cost (older journals) are priced from the price history in
+        effect at their timestamp, then from the workbook.
+        """
+        import pandas as pd
+
+        sales_path = get_sales_path(path)
+        if not os.path.exists(sales_path):
+            return None
+        sales = pd.read_json(sales_path, lines=True, dtype={"barcode": str})
+        if sales.empty:
+            return None
+        for col in ("price", "cost", "discount"):
+            if col not in sales.columns:
+                sales[col] = float("nan")
+        sales["timestamp"] = pd.to_datetime(sales["timestamp"])
+
+        history = PriceHistory(self.history_path).to_frame()
+        if not history.empty:
+            # Prices from before history was kept apply from the start
+            history["effective_from"] = pd.to_datetime(
+                history["effective_from"].replace(BEGINNING, "1970-01-01T00:00:00")
+            )
+            sales = pd.merge_asof(
+                sales.sort_values("timestamp"),
+                history.sort_values("effective_from"),
+                left_on="timestamp",
+                right_on="effective_from",
+                by="barcode",
+                direction="backward",
+            )
+            sales["price"] = sales["price"].fillna(sales["sale_price"])
+            sales["cost"] = sales["cost"].fillna(sales["original_price"])
+
+        current = items.drop_duplicates("barcode").set_index("barcode")
+        sales["price"] = sales["price"].fillna(
+            sales["barcode"].map(current["sale_price"])
+        )
+        sales["cost"] = sales["cost"].fillna(
+            sales["barcode"].map(current["original_price"])
+        )
+        discount = sales["discount"].fillna(0)
+        sales["revenue"] = sales["qty"] * sales["price"].fillna(0) - discount
+        sales["cost"] = sales["qty"] * sales["cost"].fillna(0)
+        return sales.groupby("barcode").agg(
+            revenue=("revenue", "sum"), cost=("cost", "sum"), archived=("qty", "sum")
+        )
+
+    @timed("reports.build")
+    def build(self, start=None, end=None, top_n=10):
+        """Return month totals, per-item totals and the top items for a range."""
+        import pandas as pd
+
+        frames = [self.load_month(path) for path in self.month_files(start, end)]
+        if not frames:
+            return None
+        items = pd.concat(frames, ignore_index=True)
+
+        sums = ["sold", "total_profit", "invested", "clean_profit", "gross_profit"]
+        months = items.groupby("month")[sums + ["left"]].sum()
+        add_ratios(months)
+
+        per_item = items.groupby("barcode").agg(
+            item_name=("item_name", "last"),
+            left=("left", "last"),
+            **{col: (col, "sum") for col in sums},
+        )
+        add_ratios(per_item)
+        top_items = per_item.nlargest(top_n, "gross_profit")
+
+        totals = months[sums].sum()
+        totals["margin"] = ratio(totals["gross_profit"], totals["total_profit"])
+        return {
+            "months": months,
+            "items": per_item,
+            "top_items": top_items,
+            "totals": totals.to_dict(),
+        }
+
+
+def ratio(numerator, denominator):
+    """numerator / denominator, with 0 where the denominator is 0."""
+    import numpy as np
+
+    numerator = np.asarray(numerator, dtype=float)
+    denominator = np.asarray(denominator, dtype=float)
+    out = np.zeros_like(numerator)
+    np.divide(numerator, denominator, out=out, where=denominator != 0)
+    return out if out.ndim else float(out)
+
+
+def add_ratios(frame):
+    """Add margin and sell-through columns in place."""
+    frame["margin"] = ratio(frame["gross_profit"], frame["total_profit"])
+    frame["sell_through"] = ratio(frame["sold"], frame["sold"] + frame["left"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Profit report across months.")
+    parser.add_argument("start", nargs="?", help="first month, YYYY-MM")
+    parser.add_argument("end", nargs="?", help="last month, YYYY-MM")
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    report = ProfitReport().build(args.start, args.end, top_n=args.top)
+    if report is None:
+        print("No monthly files in that range.")
+    else:
+        print(report["months"].to_string())
+        print()
+        print(report["top_items"].to_string())
+        print()
+        for name, value in report["totals"].items():
+            print(f"{name}: {value:,.2f}")
+
+
+if __name__ == "__main__":
+    main()
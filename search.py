@@ -0,0 +1,175 @@
+import time
+from bisect import bisect_left
+from metrics import timed
+
+# Typos are only looked up for words at least this long
+FUZZY_MIN_LENGTH = 3
+
+
+def normalize(text):
+    return " ".join(str(text).casefold().split())
+
+
+def deletes(word):
+    """Every string one deletion away from word."""
+    return {word[:i] + word[i + 1 :] for i in range(len(word))}
+
+
+def within_one_edit(a, b):
+    """True if a and b differ by at most one insert, delete, substitution or swap."""
+    if a == b:
+        return True
+    if abs(len(a) - len(b)) > 1:
+        return False
+    if len(a) > len(b):
+        a, b = b, a
+    i = 0
+    while i < len(a) and a[i] == b[i]:
+        i += 1
+    if len(a) == len(b):
+        swapped = a[i + 1 : i + 2] + a[i : i + 1] == b[i : i + 2]
+        return a[i + 1 :] == b[i + 1 :] or (swapped and a[i + 2 :] == b[i + 2 :])
+    return a[i:] == b[i + 1 :]
+
+
+def prefix_count(keys, prefix):
+    """Number of entries prefix_range() would yield, found with two bisects."""
+    return bisect_left(keys, (prefix + "\U0010ffff",)) - bisect_left(keys, (prefix,))
+
+
+def prefix_range(keys, prefix):
+    """Yield entries of a sorted list of tuples whose first field starts with prefix."""
+    for i in range(bisect_left(keys, (prefix,)), len(keys)):
+        if not keys[i][0].startswith(prefix):
+            return
+        yield keys[i]
+
+
+class ItemSearchIndex:
+    """In-memory type-ahead index over item names and barcodes.
+
+    Names and barcodes live in sorted lists, so a prefix lookup is a bisect
+    plus a walk over the matches. Whole words within one typo are found
+    through a map of single-character deletions, like SymSpell does.
+    """
+
+    def __init__(self, items=None):
+        self.items = {}
+        self.built_at = 0.0
+        self.build(items or {})
+
+    @timed("search.build")
+    def build(self, items):
+        """Index a barcode -> item dict, replacing what was indexed before."""
+        barcode_keys = []
+        name_keys = []
+        word_keys = []
+        item_words = {}
+        word_items = {}
+        delete_words = {}
+
+        for barcode, item in items.items():
+            barcode = str(barcode)
+            name = normalize(item.get("Item Name") or "")
+            barcode_keys.append((barcode.casefold(), barcode))
+            name_keys.append((name, barcode))
+            words = name.split()
+            item_words[barcode] = words
+            for word in set(words):
+                word_keys.append((word, barcode))
+                if word not in word_items:
+                    word_items[word] = []
+                    if len(word) >= FUZZY_MIN_LENGTH:
+                        for deleted in deletes(word):
+                            delete_words.setdefault(deleted, set()).add(word)
+                word_items[word].append(barcode)
+
+        self.items = {str(barcode): item for barcode, item in items.items()}
+        self.barcode_keys = sorted(barcode_keys)
+        self.name_keys = sorted(name_keys)
+        self.word_keys = sorted(word_keys)
+        self.item_words = item_words
+        self.word_items = word_items
+        self.delete_words = delete_words
+        self.built_at = time.monotonic()
+
+    def fuzzy_words(self, token):
+        """Indexed words within one edit of token."""
+        if len(token) < FUZZY_MIN_LENGTH:
+            return set()
+        candidates = set(self.delete_words.get(token, ()))
+        if token in self.word_items:
+            candidates.add(token)
+        for deleted in deletes(token):
+            if deleted in self.word_items:
+                candidates.add(deleted)
+            candidates.update(self.delete_words.get(deleted, ()))
+        return {word for word in candidates if within_one_edit(token, word)}
+
+    def token_matches(self, token, words):
+        """True if token is a prefix of, or one typo away from, one of words."""
+        return any(
+            word.startswith(token)
+            or (len(token) >= FUZZY_MIN_LENGTH and within_one_edit(token, word))
+            for word in words
+        )
+
+    @timed("search.query")
+    def search(self, query, limit=10):
+        """Return up to `limit` items, best matches first.
+
+        Ranking: exact barcode, barcode prefix, name prefix, word prefix and
+        finally names with a one-letter typo or swapped letters.
+        """
+        query = normalize(query)
+        if not query:
+            return []
+
+        found = {}
+
+        def add(barcodes):
+            for barcode in barcodes:
+                if len(found) >= limit:
+                    return True
+                found.setdefault(barcode, None)
+            return len(found) >= limit
+
+        tokens = query.split()
+        # An exact barcode sorts first among its prefix matches
+        if len(tokens) == 1 and add(
+            barcode for _key, barcode in prefix_range(self.barcode_keys, query)
+        ):
+            return self.results(found)
+        if add(barcode for _key, barcode in prefix_range(self.name_keys, query)):
+            return self.results(found)
+
+        # Every token has to match some word; start from the one with the
+        # fewest candidate items and check the others against those only
+        fuzzy = {token: self.fuzzy_words(token) for token in tokens}
+
+        def candidate_count(token):
+            return prefix_count(self.word_keys, token) + sum(
+                len(self.word_items[word]) for word in fuzzy[token]
+            )
+
+        first, *rest = sorted(tokens, key=candidate_count)
+
+        def matches_rest(barcode):
+            words = self.item_words[barcode]
+            return all(self.token_matches(token, words) for token in rest)
+
+        if add(
+            barcode
+            for _word, barcode in prefix_range(self.word_keys, first)
+            if matches_rest(barcode)
+        ):
+            return self.results(found)
+        for word in sorted(fuzzy[first]):
+            if add(
+                barcode for barcode in self.word_items[word] if matches_rest(barcode)
+            ):
+                break
+        return self.results(found)
+
+    def results(self, found):
+        return [dict(self.items[barcode]) for barcode in found]
@@ -0,0 +1,516 @@
+"""Local inventory service shared by several tills on the same data folder.
+
+One process owns the inventory and keeps it hot in memory; tills talk to it
+over a localhost socket with one JSON object per line:
+
+    {"id": 1, "op": "find_item_by_barcode", "args": ["4780022250220"]}
+    {"id": 1, "ok": true, "result": {...}}
+
+Writes also carry a "key" chosen by the till. The service answers a repeated
+key with the first result instead of running the write again, so a till can
+safely resend a sale after a dropped connection.
+
+A connection that sends {"op": "watch_stock"} is also pushed stock changes:
+
+    {"event": "stock", "changes": {"4780022250220": 41}}
+
+    python service.py [--host 127.0.0.1] [--port 8765]
+
+Start the app with POS_SERVICE=host:port to use it instead of the files.
+"""
+
+import argparse
+import asyncio
+import json
+import socket
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+# Wait before reconnecting a stock event connection that dropped
+WATCH_RETRY_SECONDS = 2.0
+# How long a till waits for a write; writes queue behind each other on the
+# service, e.g. behind a large import
+WRITE_TIMEOUT = 600.0
+# Writes remembered by key for tills that resend them
+KEEP_WRITES = 1000
+
+# Operations that change the inventory run one at a time, in arrival order
+WRITE_OPS = {
+    "record_sale",
+    "record_business_sale",
+    "commit_sale",
+    "add_inventory_item",
+    "import_items",
+}
+
+
+class InventoryBackend:
+    """The operations the service exposes, backed by the real handlers."""
+
+    def __init__(self, excel_handler=None):
+        from excel import ExcelHandler
+        from inventory import InventoryHandler
+        from pos import POSHandler
+
+        self.excel_handler = excel_handler or ExcelHandler()
+        self.pos_handler = POSHandler(self.excel_handler)
+        self.inventory_handler = InventoryHandler(self.excel_handler)
+
+    def get_ops(self):
+        return {
+            "find_item_by_barcode": self.pos_handler.find_item_by_barcode,
+            "record_sale": self.pos_handler.record_sale,
+            "record_business_sale": self.pos_handler.record_business_sale,
+            "commit_sale": self.pos_handler.commit_sale,
+            "get_discounts": self.pos_handler.get_discounts,
+            "add_inventory_item": self.inventory_handler.add_inventory_item,
+            "get_inventory_item": self.inventory_handler.get_inventory_item,
+            "import_items": self.inventory_handler.import_items,
+            "get_items": self.get_items,
+            "ensure_current_month": self.excel_handler.ensure_current_month,
+        }
+
+    def subscribe_stock(self, callback):
+        self.pos_handler.subscribe_stock(callback)
+
+    def get_items(self):
+        # The index may be a lazily decoded mapping; send a plain dict
+        return dict(self.excel_handler.storage.get_items())
+
+    def close(self):
+        self.pos_handler.close()
+
+
+class MemoryBackend:
+    """In-memory stand-in for InventoryBackend, for tests and demos."""
+
+    def __init__(self, items=None):
+        self.items = {item["Barcode"]: dict(item) for item in items or []}
+        self.sales = []
+        self.lock = threading.Lock()
+        self.stock_callbacks = []
+
+    def find_item_by_barcode(self, barcode):
+        with self.lock:
+            item = self.items.get(str(barcode))
+            return dict(item) if item else None
+
+    def commit_sale(self, cart):
+        changes = {}
+        with self.lock:
+            for barcode, qty in cart.items():
+                item = self.items.get(str(barcode))
+                if item:
+                    item["Inventory Quantity"] = max(
+                        0, item["Inventory Quantity"] - qty
+                    )
+                    changes[item["Barcode"]] = item["Inventory Quantity"]
+            self.sales.append(dict(cart))
+        self.notify_stock(changes)
+
+    def record_sale(self, cart, discounts=None):
+        self.commit_sale(cart)
+
+    def record_business_sale(self, cart, customer, discounts=None):
+        with self.lock:
+            for barcode, qty in cart.items():
+                item = self.items.get(str(barcode))
+                if item is None or qty > item["Inventory Quantity"]:
+                    raise ValueError(f"Not enough stock for {barcode}")
+        self.commit_sale(cart)
+
+    def add_inventory_item(self, *fields):
+        from inventory import validate_item
+
+        item = validate_item(*fields)
+        with self.lock:
+            self.items[item["Barcode"]] = item
+        self.notify_stock({item["Barcode"]: item["Inventory Quantity"]})
+
+    def subscribe_stock(self, callback):
+        self.stock_callbacks.append(callback)
+
+    def notify_stock(self, changes):
+        for callback in list(self.stock_callbacks):
+            callback(changes)
+
+    def get_items(self):
+        with self.lock:
+            return {barcode: dict(item) for barcode, item in self.items.items()}
+
+    def get_ops(self):
+        return {
+            "find_item_by_barcode": self.find_item_by_barcode,
+            "record_sale": self.record_sale,
+            "record_business_sale": self.record_business_sale,
+            "commit_sale": self.commit_sale,
+            "get_discounts": lambda: {"rules": [], "categories": {}},
+            "add_inventory_item": self.add_inventory_item,
+            "get_inventory_item": self.find_item_by_barcode,
+            "get_items": self.get_items,
+            "ensure_current_month": lambda: None,
+        }
+
+    def close(self):
+        pass
+
+
+class InventoryService:
+    """asyncio server that answers inventory requests from the tills."""
+
+    def __init__(self, backend, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        self.backend = backend
+        self.ops = backend.get_ops()
+        self.host = host
+        self.port = port
+        self.server = None
+        self.loop = None
+        self.client_tasks = set()
+        # Writers of the connections that asked for stock change events
+        self.watchers = set()
+        # Write key -> task with its result, oldest first
+        self.writes = OrderedDict()
+        self.read_executor = ThreadPoolExecutor(max_workers=4)
+        self.write_executor = ThreadPoolExecutor(max_workers=1)
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.backend.subscribe_stock(self.on_stock_changed)
+        self.server = await asyncio.start_server(
+            self.handle_client, self.host, self.port
+        )
+        # Port 0 means "any free port"; report the real one
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self.host, self.port
+
+    async def serve_forever(self):
+        await self.start()
+        print(f"Inventory service listening on {self.host}:{self.port}")
+        asyncio.get_running_loop().create_task(self.check_month_rollover())
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def check_month_rollover(self):
+        """Roll over to a new monthly file even when no till is busy."""
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(60)
+            try:
+                await loop.run_in_executor(
+                    self.write_executor, self.ops["ensure_current_month"]
+                )
+            except Exception as e:
+                print(f"Error starting new month: {e}")
+
+    async def handle_client(self, reader, writer):
+        task = asyncio.current_task()
+        self.client_tasks.add(task)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                response = await self.handle_request(line, writer)
+                writer.write(json.dumps(response, default=str).encode() + b"\n")
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self.watchers.discard(writer)
+            writer.close()
+            self.client_tasks.discard(task)
+
+    def on_stock_changed(self, changes):
+        """Called from the executor threads; pushes the event from the loop."""
+        if self.loop is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.broadcast, changes)
+
+    def broadcast(self, changes):
+        line = json.dumps({"event": "stock", "changes": changes}).encode() + b"\n"
+        for writer in list(self.watchers):
+            if writer.is_closing():
+                self.watchers.discard(writer)
+            else:
+                writer.write(line)
+
+    async def shutdown(self):
+        """Stop listening and drop the connected tills."""
+        if self.server:
+            self.server.close()
+        for task in list(self.client_tasks):
+            task.cancel()
+        await asyncio.gather(*self.client_tasks, return_exceptions=True)
+
+    async def handle_request(self, line, writer=None):
+        request_id = None
+        try:
+            request = json.loads(line)
+            request_id = request.get("id")
+            op = request["op"]
+            if op == "watch_stock":
+                # From now on this connection also receives stock events
+                self.watchers.add(writer)
+                return {"id": request_id, "ok": True, "result": None}
+            if op not in self.ops:
+                raise ValueError(f"Unknown operation: {op}")
+            args = request.get("args", [])
+            key = request.get("key")
+            if key is None:
+                result = await self.run_op(op, args)
+            else:
+                task = self.writes.get(key)
+                if task is None:
+                    task = asyncio.ensure_future(self.run_op(op, args))
+                    self.writes[key] = task
+                    while len(self.writes) > KEEP_WRITES:
+                        self.writes.popitem(last=False)
+                # A resend waits for the first request; a dropped connection
+                # never cancels the write itself
+                result = await asyncio.shield(task)
+            return {"id": request_id, "ok": True, "result": result}
+        except Exception as e:
+            return {"id": request_id, "ok": False, "error": str(e)}
+
+    async def run_op(self, op, args):
+        executor = self.write_executor if op in WRITE_OPS else self.read_executor
+        return await asyncio.get_running_loop().run_in_executor(
+            executor, lambda: self.ops[op](*args)
+        )
+
+    def close(self):
+        self.read_executor.shutdown(wait=True)
+        self.write_executor.shutdown(wait=True)
+        self.backend.close()
+
+
+class ServiceThread:
+    """Run an InventoryService on its own event loop in a background thread."""
+
+    def __init__(self, service):
+        self.service = service
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+
+    def start(self):
+        """Start serving and return the (host, port) address."""
+        self.thread.start()
+        future = asyncio.run_coroutine_threadsafe(self.service.start(), self.loop)
+        return future.result()
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self.service.shutdown(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+        self.service.close()
+
+
+class FakeInventoryService(ServiceThread):
+    """In-process service over MemoryBackend on a free localhost port."""
+
+    def __init__(self, items=None):
+        super().__init__(InventoryService(MemoryBackend(items), port=0))
+
+    @property
+    def backend(self):
+        return self.service.backend
+
+
+class Connection:
+    """One connection to the service, used by one request at a time."""
+
+    def __init__(self, address, timeout):
+        self.address = address
+        self.timeout = timeout
+        self.sock = None
+        self.reader = None
+        self.next_id = 0
+        self.lock = threading.Lock()
+
+    def connect(self):
+        self.sock = socket.create_connection(self.address, timeout=self.timeout)
+        self.reader = self.sock.makefile("rb")
+
+    def send(self, request, timeout):
+        """Send one request and return the response line."""
+        self.next_id += 1
+        request["id"] = self.next_id
+        try:
+            if self.sock is None:
+                self.connect()
+            self.sock.settimeout(timeout)
+            self.sock.sendall(json.dumps(request).encode() + b"\n")
+            line = self.reader.readline()
+        except OSError as e:
+            self.disconnect()
+            raise ConnectionError(f"Inventory service unavailable: {e}")
+        if not line:
+            self.disconnect()
+            raise ConnectionError("Inventory service closed the connection")
+        return line
+
+    def disconnect(self):
+        if self.sock is not None:
+            self.reader.close()
+            self.sock.close()
+        self.sock = None
+        self.reader = None
+
+
+class InventoryClient:
+    """Thin client with the POSHandler/InventoryHandler methods the widgets use."""
+
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, timeout=10.0):
+        self.address = (host, port)
+        self.timeout = timeout
+        # Widgets call in from several worker threads. Reads get their own
+        # connection so a scan never queues behind a write waiting on the
+        # workbook
+        self.reads = Connection(self.address, timeout)
+        self.writes = Connection(self.address, timeout)
+        # Connections that receive stock events, one per subscriber
+        self.watch_socks = set()
+        self.closed = False
+
+    @classmethod
+    def from_address(cls, address):
+        """Build a client from 'host:port' (or just 'port')."""
+        host, _, port = address.rpartition(":")
+        return cls(host or DEFAULT_HOST, int(port))
+
+    def call(self, op, *args):
+        """Run op on the service.
+
+        Writes wait up to WRITE_TIMEOUT and are sent once more, under the
+        same key, if the connection drops, which the service answers without
+        running them twice.
+        """
+        request = {"op": op, "args": list(args)}
+        connection = self.reads
+        timeout = self.timeout
+        attempts = 1
+        if op in WRITE_OPS:
+            request["key"] = uuid.uuid4().hex
+            connection = self.writes
+            timeout = WRITE_TIMEOUT
+            attempts = 2
+        with connection.lock:
+            for attempt in range(attempts):
+                try:
+                    line = connection.send(request, timeout)
+                    break
+                except ConnectionError:
+                    if attempt + 1 == attempts:
+                        raise
+
+        response = json.loads(line)
+        if not response["ok"]:
+            raise ValueError(response["error"])
+        return response["result"]
+
+    def find_item_by_barcode(self, barcode):
+        return self.call("find_item_by_barcode", barcode)
+
+    def record_sale(self, cart, discounts=None):
+        return self.call("record_sale", cart, discounts)
+
+    def record_business_sale(self, cart, customer, discounts=None):
+        return self.call("record_business_sale", cart, customer, discounts)
+
+    def commit_sale(self, cart):
+        return self.call("commit_sale", cart)
+
+    def add_inventory_item(
+        self, barcode, item_name, original_price, sale_price, inventory_quantity
+    ):
+        return self.call(
+            "add_inventory_item",
+            barcode,
+            item_name,
+            original_price,
+            sale_price,
+            inventory_quantity,
+        )
+
+    def get_discounts(self):
+        return self.call("get_discounts")
+
+    def get_inventory_item(self, barcode):
+        return self.call("get_inventory_item", barcode)
+
+    def import_items(self, path, add_to_stock=True):
+        imported, rejected = self.call("import_items", path, add_to_stock)
+        return imported, rejected
+
+    def get_items(self):
+        return self.call("get_items")
+
+    def subscribe_stock(self, callback):
+        """Call callback({barcode: quantity left}) on every stock change.
+
+        Events arrive on a second connection read by a background thread,
+        which reconnects if the service restarts.
+        """
+        threading.Thread(target=self.watch_stock, args=(callback,), daemon=True).start()
+
+    def watch_stock(self, callback):
+        while not self.closed:
+            try:
+                sock = socket.create_connection(self.address)
+            except OSError as e:
+                print(f"Stock events unavailable: {e}")
+            else:
+                self.watch_socks.add(sock)
+                try:
+                    request = {"id": 0, "op": "watch_stock", "args": []}
+                    sock.sendall(json.dumps(request).encode() + b"\n")
+                    with sock.makefile("rb") as reader:
+                        for line in reader:
+                            message = json.loads(line)
+                            if message.get("event") == "stock":
+                                callback(message["changes"])
+                except (OSError, ValueError) as e:
+                    if not self.closed:
+                        print(f"Stock events interrupted: {e}")
+                finally:
+                    self.watch_socks.discard(sock)
+                    sock.close()
+            if not self.closed:
+                time.sleep(WATCH_RETRY_SECONDS)
+
+    def close(self):
+        self.closed = True
+        for sock in list(self.watch_socks):
+            try:
+                # Wakes the thread blocked reading events
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        for connection in (self.reads, self.writes):
+            with connection.lock:
+                connection.disconnect()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the local inventory service.")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    args = parser.parse_args()
+
+    service = InventoryService(InventoryBackend(), args.host, args.port)
+    try:
+        asyncio.run(service.serve_forever())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # asyncio.run() has already cancelled the client handlers
+        service.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+import mmap
+import os
+import re
+import socket
+import struct
+from locks import FileLock
+
+MAGIC = b"POSCART1"
+# magic, slot size
+HEADER = struct.Struct("<8sI")
+# used, order, quantity, price, barcode, item name
+SLOT = struct.Struct("<B3xIid64s96s")
+# Values of the used byte: a line of the open cart, or of a sale that has
+# been queued but not recorded yet
+OPEN = 1
+SUBMITTED = 2
+ORDER_OFFSET = 4
+QUANTITY_OFFSET = 8
+DEFAULT_SLOTS = 128
+
+
+def get_till_id():
+    """This till's name: POS_TILL_ID if set, else the computer's host name."""
+    return os.environ.get("POS_TILL_ID") or socket.gethostname()
+
+
+def get_session_path(till_id=None):
+    """Cart file of one till, so tills sharing a data folder keep their own."""
+    name = re.sub(r"[^\w.-]", "_", till_id or get_till_id())
+    return os.path.join("data", f"cart.{name}.session")
+
+
+SESSION_PATH = get_session_path()
+
+
+def encode(text, size):
+    """UTF-8 bytes cut to fit a fixed field without splitting a character."""
+    data = str(text).encode("utf-8")[:size]
+    return data.decode("utf-8", "ignore").encode("utf-8")
+
+
+class CartSession:
+    """The open cart mirrored into a memory-mapped file of fixed-size slots.
+
+    Every cart line owns one slot, so a scan or a +/- click is a single
+    struct.pack_into on the mapping: no serializing and no flush. The pages
+    belong to the OS, so they outlive a crash of the app and the cart is
+    read back on the next start. Only one window may have a session open;
+    another one gets an OSError.
+    """
+
+    def __init__(self, path=SESSION_PATH, slots=DEFAULT_SLOTS):
+        self.path = path
+        # barcode -> slot number, and the slots nobody uses
+        self.slots = {}
+        self.free = []
+        self.next_order = 0
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.lock = FileLock(path + ".lock", timeout=0, reentrant=False)
+        try:
+            self.lock.acquire()
+        except TimeoutError:
+            raise OSError(f"{path} is already open in another POS window")
+        self.file = open(path, "a+b")
+        self.file.seek(0)
+        header = self.file.read(HEADER.size)
+        # Start over if the file is not a session in this layout
+        if len(header) < HEADER.size or HEADER.unpack(header) != (MAGIC, SLOT.size):
+            self.file.truncate(0)
+            self.file.write(HEADER.pack(MAGIC, SLOT.size))
+            self.file.flush()
+        self.capacity = 0
+        self.map = None
+        self.remap(max(slots, self.stored_capacity()))
+
+    def stored_capacity(self):
+        size = os.path.getsize(self.path)
+        return max(0, (size - HEADER.size) // SLOT.size)
+
+    def remap(self, capacity):
+        """Map the file with room for `capacity` slots, growing it if needed."""
+        if self.map is not None:
+            self.map.close()
+        size = HEADER.size + capacity * SLOT.size
+        if os.path.getsize(self.path) < size:
+            self.file.truncate(size)
+        self.map = mmap.mmap(self.file.fileno(), size)
+        # Hand out low slots first
+        self.free.extend(reversed(range(self.capacity, capacity)))
+        self.free.sort(reverse=True)
+        self.capacity = capacity
+
+    def offset(self, slot):
+        return HEADER.size + slot * SLOT.size
+
+    def load(self):
+        """Lines left by the last run, in the order they were scanned.
+
+        Lines of a sale that was queued but never confirmed come back too,
+        marked "submitted", since the sale may not have been recorded; they
+        are merged with an open line of the same barcode. The slots are
+        taken over, so the restored cart keeps writing to the same places;
+        damaged slots are freed.
+        """
+        lines = {}
+        self.slots = {}
+        self.free = []
+        for slot in range(self.capacity):
+            used, order, quantity, price, barcode, name = SLOT.unpack_from(
+                self.map, self.offset(slot)
+            )
+            barcode = barcode.rstrip(b"\0").decode("utf-8", "ignore")
+            if used not in (OPEN, SUBMITTED) or quantity <= 0 or not barcode:
+                self.map[self.offset(slot)] = 0
+                self.free.append(slot)
+                continue
+            line = lines.get(barcode)
+            if line is not None:
+                line[1]["quantity"] += quantity
+                line[1]["submitted"] |= used == SUBMITTED
+                self.set_quantity(barcode, line[1]["quantity"])
+                self.map[self.offset(slot)] = 0
+                self.free.append(slot)
+                continue
+            self.map[self.offset(slot)] = OPEN
+            self.slots[barcode] = slot
+            self.next_order = max(self.next_order, order)
+            lines[barcode] = (
+                order,
+                {
+                    "barcode": barcode,
+                    "name": name.rstrip(b"\0").decode("utf-8", "ignore"),
+                    "price": price,
+                    "quantity": quantity,
+                    "submitted": used == SUBMITTED,
+                },
+            )
+        self.free.sort(reverse=True)
+        lines = sorted(lines.values(), key=lambda line: line[0])
+        return [line for _order, line in lines]
+
+    def put_line(self, barcode, item_name, price, quantity):
+        """Write a whole line, taking a free slot for a new barcode."""
+        slot = self.slots.get(barcode)
+        if slot is None:
+            if not self.free:
+                self.remap(self.capacity * 2)
+            slot = self.slots[barcode] = self.free.pop()
+            self.next_order += 1
+            order = self.next_order
+        else:
+            order = struct.unpack_from(
+                "<I", self.map, self.offset(slot) + ORDER_OFFSET
+            )[0]
+        SLOT.pack_into(
+            self.map,
+            self.offset(slot),
+            OPEN,
+            order,
+            quantity,
+            price,
+            encode(barcode, 64),
+            encode(item_name, 96),
+        )
+
+    def set_quantity(self, barcode, quantity):
+        """Update one line's quantity in place; 0 frees the slot."""
+        slot = self.slots.get(barcode)
+        if slot is None:
+            return
+        if quantity <= 0:
+            self.map[self.offset(slot)] = 0
+            self.free.append(self.slots.pop(barcode))
+        else:
+            struct.pack_into(
+                "<i", self.map, self.offset(slot) + QUANTITY_OFFSET, quantity
+            )
+
+    def clear(self):
+        """Empty the cart, e.g. after a sale."""
+        for slot in self.slots.values():
+            self.map[self.offset(slot)] = 0
+            self.free.append(slot)
+        self.free.sort(reverse=True)
+        self.slots = {}
+        self.next_order = 0
+
+    def submit(self):
+        """Hand the cart over to a queued sale and start an empty one.
+
+        Its slots stay in the file, marked submitted, until release(), so a
+        crash before the sale is recorded still finds the lines; returns the
+        slots.
+        """
+        slots = list(self.slots.values())
+        for slot in slots:
+            self.map[self.offset(slot)] = SUBMITTED
+        self.slots = {}
+        return slots
+
+    def release(self, slots):
+        """Free the slots of a submitted sale once it is recorded or undone."""
+        for slot in slots:
+            self.map[self.offset(slot)] = 0
+            self.free.append(slot)
+        self.free.sort(reverse=True)
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+        self.lock.release()
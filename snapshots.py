@@ -0,0 +1,308 @@
+"""Incremental, deduplicated snapshots of the monthly workbooks.
+
+Every save of a monthly file records a snapshot in data/snapshots/<month>/:
+
+    objects/ab/cdef...   zlib-compressed JSON of CHUNK_ROWS sheet rows,
+                         named by the SHA-256 of the rows
+    manifests/<time>.json  the chunk names that make up each sheet
+
+A chunk is only written when its rows are new, so a sale costs the few
+chunks holding the sold rows plus a small manifest. Old snapshots are thinned
+out by prune() and restore() rebuilds a workbook as of any point in time:
+
+    python snapshots.py list POS_2025_03
+    python snapshots.py restore POS_2025_03 2025-03-14T18:00 [target.xlsx]
+    python snapshots.py take data/POS_2025_03.xlsx
+    python snapshots.py prune
+"""
+
+import glob
+import hashlib
+import json
+import os
+import sys
+import zlib
+from datetime import date, datetime, time, timedelta
+from metrics import timed
+
+SNAPSHOT_DIR = "snapshots"
+CHUNK_ROWS = 64
+# Retention: the newest KEEP_RECENT snapshots of a month, then the last one
+# of each day for KEEP_DAYS days; the newest snapshot is never removed
+KEEP_RECENT = 50
+KEEP_DAYS = 90
+# Snapshots between automatic prunes
+PRUNE_EVERY = 100
+
+
+def encode_value(value):
+    if isinstance(value, (datetime, date, time)):
+        return {"datetime": value.isoformat()}
+    return str(value)
+
+
+def decode_value(value):
+    if isinstance(value, dict) and "datetime" in value:
+        return datetime.fromisoformat(value["datetime"])
+    return value
+
+
+def month_name(path):
+    """POS_2025_03 for data/POS_2025_03.xlsx; a month name is passed through."""
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+class SnapshotStore:
+    """Content-addressed snapshot store for the workbooks in one data folder."""
+
+    def __init__(self, root):
+        self.root = root
+        # path -> what the last snapshot saw, so the next one only re-reads
+        # the rows that changed: {"version", "sheets": {title: sheet state}}
+        self.state = {}
+        self.taken = 0
+
+    def month_dir(self, month):
+        return os.path.join(self.root, month_name(month))
+
+    def object_path(self, month, digest):
+        return os.path.join(self.month_dir(month), "objects", digest[:2], digest[2:])
+
+    def manifest_paths(self, month):
+        """Manifest files of a month, oldest first."""
+        pattern = os.path.join(self.month_dir(month), "manifests", "*.json")
+        return sorted(glob.glob(pattern))
+
+    def put_chunk(self, month, rows):
+        """Store rows once and return their content hash."""
+        data = json.dumps(rows, default=encode_value, separators=(",", ":"))
+        digest = hashlib.sha256(data.encode("utf-8")).hexdigest()
+        path = self.object_path(month, digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = path + ".tmp"
+            with open(temp_path, "wb") as f:
+                f.write(zlib.compress(data.encode("utf-8")))
+            os.replace(temp_path, path)
+        return digest
+
+    def get_chunk(self, month, digest):
+        with open(self.object_path(month, digest), "rb") as f:
+            rows = json.loads(zlib.decompress(f.read()))
+        return [[decode_value(value) for value in row] for row in rows]
+
+    def read_rows(self, ws, chunk):
+        """Values of one chunk of rows, without trailing empty cells."""
+        start = chunk * CHUNK_ROWS + 1
+        rows = []
+        for row in ws.iter_rows(
+            min_row=start,
+            max_row=min(start + CHUNK_ROWS - 1, ws.max_row),
+            max_col=ws.max_column,
+            values_only=True,
+        ):
+            row = list(row)
+            while row and row[-1] is None:
+                row.pop()
+            rows.append(row)
+        return rows
+
+    @timed("snapshots.take")
+    def take(self, path, wb, changed_rows=None, previous_version=None, version=None):
+        """Snapshot wb as just saved to path.
+
+        changed_rows are the active sheet's rows touched since the previous
+        snapshot. They are trusted only if previous_version is the file
+        version that snapshot saw; otherwise every chunk is re-read. Returns
+        the manifest path, or None when nothing changed.
+        """
+        old = self.state.get(path)
+        incremental = (
+            old is not None
+            and changed_rows is not None
+            and previous_version is not None
+            and old["version"] == previous_version
+        )
+
+        sheets = {}
+        for ws in wb.worksheets:
+            count = -(-ws.max_row // CHUNK_ROWS)
+            previous = old["sheets"].get(ws.title) if incremental else None
+            if previous is None or previous["max_column"] != ws.max_column:
+                dirty = range(count)
+                chunks = []
+            else:
+                chunks = previous["chunks"][:count]
+                dirty = set(range(len(chunks), count))
+                if ws is wb.active:
+                    dirty.update(
+                        (row - 1) // CHUNK_ROWS
+                        for row in changed_rows
+                        if (row - 1) // CHUNK_ROWS < count
+                    )
+            chunks = chunks + [None] * (count - len(chunks))
+            for chunk in dirty:
+                chunks[chunk] = self.put_chunk(path, self.read_rows(ws, chunk))
+            sheets[ws.title] = {"max_column": ws.max_column, "chunks": chunks}
+
+        unchanged = old is not None and old["sheets"] == sheets
+        self.state[path] = {"version": version, "sheets": sheets}
+        if unchanged:
+            return None
+
+        created = datetime.now()
+        manifest = {
+            "created": created.isoformat(timespec="microseconds"),
+            "file": os.path.basename(path),
+            "active": wb.active.title,
+            "sheets": [
+                {"title": title, "chunks": sheet["chunks"]}
+                for title, sheet in sheets.items()
+            ],
+        }
+        manifest_dir = os.path.join(self.month_dir(path), "manifests")
+        os.makedirs(manifest_dir, exist_ok=True)
+        manifest_path = os.path.join(
+            manifest_dir, created.strftime("%Y%m%dT%H%M%S%f") + ".json"
+        )
+        with open(manifest_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        os.replace(manifest_path + ".tmp", manifest_path)
+
+        self.taken += 1
+        if self.taken % PRUNE_EVERY == 0:
+            self.prune(path)
+        return manifest_path
+
+    def load_manifest(self, manifest_path):
+        with open(manifest_path, encoding="utf-8") as f:
+            return json.load(f)
+
+    def list(self, month):
+        """(created, manifest path) for every snapshot of a month, oldest first."""
+        snapshots = []
+        for manifest_path in self.manifest_paths(month):
+            try:
+                created = self.load_manifest(manifest_path)["created"]
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Skipping damaged snapshot {manifest_path}: {e}")
+                continue
+            snapshots.append((created, manifest_path))
+        return snapshots
+
+    def find(self, month, when=None):
+        """Manifest path of the latest snapshot taken at or before `when`."""
+        found = None
+        for created, manifest_path in self.list(month):
+            if when is None or created <= when:
+                found = manifest_path
+        return found
+
+    @timed("snapshots.restore")
+    def restore(self, month, when=None, target=None):
+        """Rebuild a month's workbook as it was at `when` (ISO time, default now).
+
+        It is written to target, by default a new file next to the live one,
+        so restoring never overwrites data by accident. Returns the path.
+        """
+        from openpyxl import Workbook
+        from excel import get_styles
+
+        manifest_path = self.find(month, when)
+        if manifest_path is None:
+            raise ValueError(f"No snapshot of {month_name(month)} at {when or 'now'}")
+        manifest = self.load_manifest(manifest_path)
+
+        styles = get_styles()
+        wb = Workbook()
+        wb.remove(wb.active)
+        for sheet in manifest["sheets"]:
+            ws = wb.create_sheet(sheet["title"])
+            row_number = 0
+            for digest in sheet["chunks"]:
+                for row in self.get_chunk(month, digest):
+                    row_number += 1
+                    for column, value in enumerate(row, start=1):
+                        if value is None:
+                            continue
+                        cell = ws.cell(row=row_number, column=column, value=value)
+                        cell.alignment = styles["alignment"]
+                        cell.font = styles["header_font" if row_number == 1 else "font"]
+        wb.active = wb.sheetnames.index(manifest["active"])
+
+        if target is None:
+            stamp = manifest["created"][:19].replace(":", "").replace("-", "")
+            target = os.path.join(
+                os.path.dirname(self.root), f"{month_name(month)}_restored_{stamp}.xlsx"
+            )
+        wb.save(target)
+        return target
+
+    @timed("snapshots.prune")
+    def prune(self, month, now=None):
+        """Apply the retention policy to a month and delete unreferenced chunks.
+
+        Call it with the month's FileLock held (take() already is), so no
+        snapshot is written while its chunks are being collected.
+        """
+        now = now or datetime.now()
+        snapshots = self.list(month)
+        keep = {manifest_path for _created, manifest_path in snapshots[-KEEP_RECENT:]}
+        cutoff = (now - timedelta(days=KEEP_DAYS)).isoformat()
+        last_of_day = {}
+        for created, manifest_path in snapshots:
+            if created >= cutoff:
+                last_of_day[created[:10]] = manifest_path
+        keep.update(last_of_day.values())
+
+        referenced = set()
+        for _created, manifest_path in snapshots:
+            if manifest_path not in keep:
+                os.remove(manifest_path)
+                continue
+            for sheet in self.load_manifest(manifest_path)["sheets"]:
+                referenced.update(sheet["chunks"])
+
+        removed = 0
+        objects = os.path.join(self.month_dir(month), "objects", "*", "*")
+        for object_path in glob.glob(objects):
+            digest = os.path.basename(os.path.dirname(object_path)) + os.path.basename(
+                object_path
+            )
+            if digest not in referenced:
+                os.remove(object_path)
+                removed += 1
+        return len(snapshots) - len(keep), removed
+
+
+def get_snapshot_root(file_path):
+    return os.path.join(os.path.dirname(file_path) or ".", SNAPSHOT_DIR)
+
+
+if __name__ == "__main__":
+    from locks import FileLock
+
+    command = sys.argv[1] if len(sys.argv) > 1 else "list"
+    args = sys.argv[2:]
+    store = SnapshotStore(os.path.join("data", SNAPSHOT_DIR))
+    if command == "list":
+        for created, manifest_path in store.list(args[0]):
+            print(created, manifest_path)
+    elif command == "restore":
+        when = args[1] if len(args) > 1 else None
+        target = args[2] if len(args) > 2 else None
+        print(f"Restored to {store.restore(args[0], when, target)}")
+    elif command == "take":
+        from openpyxl import load_workbook
+
+        store = SnapshotStore(get_snapshot_root(args[0]))
+        with FileLock(args[0] + ".lock"):
+            print(store.take(args[0], load_workbook(args[0])) or "No changes")
+    elif command == "prune":
+        for month_dir in sorted(glob.glob(os.path.join(store.root, "*"))):
+            month = os.path.basename(month_dir)
+            with FileLock(os.path.join("data", month + ".xlsx.lock")):
+                deleted, removed = store.prune(month)
+            print(f"{month}: {deleted} snapshots and {removed} chunks removed")
+    else:
+        print(f"Unknown command: {command}")
@@ -0,0 +1,574 @@
+import os
+import sqlite3
+import sys
+import threading
+from collections import deque
+from excel import HEADERS
+from locks import FileLock
+from metrics import span, timed
+
+# Item fields the handlers write, in sheet order
+ITEM_FIELDS = [
+    "Barcode",
+    "Item Name",
+    "Inventory Quantity",
+    "Original Price",
+    "Sale Price",
+]
+
+# Workbook property listing the journal batches already taken off the stock
+APPLIED_BATCHES = "POS Applied Batches"
+# Batches remembered; only a compaction cut short by a crash replays one
+KEEP_BATCHES = 100
+
+
+def stock_changes(changed_items):
+    """{barcode: quantity left} for the rows of a write that touched stock."""
+    return {
+        barcode: values["Inventory Quantity"]
+        for barcode, values in changed_items.items()
+        if "Inventory Quantity" in values
+    }
+
+
+class Storage:
+    """Interface between the handlers and wherever the inventory lives."""
+
+    def find_item(self, barcode):
+        """Return the item stored under the barcode, or None."""
+        raise NotImplementedError
+
+    def get_items(self):
+        """Return every item as a barcode -> item dict."""
+        raise NotImplementedError
+
+    def upsert_item(self, item):
+        """Insert the item or overwrite the one with the same barcode."""
+        self.upsert_items([item])
+
+    def upsert_items(self, items, add_quantity=False):
+        """Upsert many items in one write.
+
+        With add_quantity, "Inventory Quantity" is added to the stored stock
+        instead of replacing it.
+        """
+        raise NotImplementedError
+
+    def apply_sale(self, cart, batch=None):
+        """Decrement stock for a cart of {barcode: quantity} in one transaction.
+
+        A journal batch id is stored in the same transaction; a batch that
+        was applied before is skipped and False returned. Like upsert_items,
+        it calls ExcelHandler.notify_stock once committed.
+        """
+        raise NotImplementedError
+
+    def export_excel(self, path=None):
+        """Write the inventory as a workbook in the ExcelHandler layout."""
+        raise NotImplementedError
+
+    def switch_file(self):
+        """Follow ExcelHandler to a new monthly file."""
+
+    def close(self):
+        """Release the backend before the app exits."""
+
+
+class WorkbookStorage(Storage):
+    """The monthly Excel file is the live database."""
+
+    def __init__(self, excel_handler):
+        self.excel_handler = excel_handler
+        self.wb = None
+        self.wb_version = None
+        self.columns = None
+        # barcode -> sheet row, built once per load and kept up to date
+        self.row_index = {}
+        # Empty rows inside the sheet, then the next row past the end
+        self.free_rows = deque()
+        self.next_row = None
+
+    def switch_file(self):
+        self.wb = None
+
+    def get_lock_path(self):
+        return self.excel_handler.get_lock_path()
+
+    def get_workbook(self, stamp=0):
+        """Return the cached workbook, reloading only if someone else saved it.
+
+        The version is the lock file's write counter plus the file's mtime and
+        size, so saves from other processes and edits made in Excel both count.
+        """
+        version = (stamp, self.excel_handler.get_file_version())
+        if self.wb is None:
+            self.load(version)
+        elif version != self.wb_version:
+            # Someone else saved since our last write
+            with span("storage.stale_reload"):
+                self.load(version)
+        return self.wb
+
+    def load(self, version):
+        self.wb = self.excel_handler.load_workbook()
+        self.wb_version = version
+        self.build_row_index(self.wb.active)
+
+    def write(self, apply_changes):
+        """Run apply_changes(ws) -> changed_items on the latest copy and save it.
+
+        The change is only applied once the file lock is held and the cached
+        workbook is known to be current; if another process saved in between,
+        the file is reloaded first and just this change is applied on top.
+        """
+        with self.excel_handler.write_lock, FileLock(self.get_lock_path()) as lock:
+            stamp = lock.read_version()
+            ws = self.get_workbook(stamp).active
+            changed_items = apply_changes(ws)
+            if changed_items:
+                self.save(changed_items, lock, stamp + 1)
+        # Subscribers run after the locks are released
+        changes = stock_changes(changed_items or {})
+        if changes:
+            self.excel_handler.notify_stock(changes)
+
+    def build_row_index(self, ws):
+        """One pass over the Barcode column to find item rows and free rows."""
+        self.columns = self.excel_handler.get_column_indexes(ws)
+        barcode_col = self.columns["Barcode"]
+        self.row_index = {}
+        self.free_rows = deque()
+        with span("storage.build_row_index"):
+            for row, (value,) in enumerate(
+                ws.iter_rows(
+                    min_row=2,
+                    min_col=barcode_col,
+                    max_col=barcode_col,
+                    values_only=True,
+                ),
+                start=2,
+            ):
+                if value is None:
+                    self.free_rows.append(row)
+                else:
+                    # The first row wins for duplicated barcodes
+                    self.row_index.setdefault(str(value), row)
+        self.next_row = ws.max_row + 1
+
+    def take_free_row(self):
+        """Hand out the first empty row, like find_first_empty_row did."""
+        if self.free_rows:
+            return self.free_rows.popleft()
+        row = self.next_row
+        self.next_row += 1
+        return row
+
+    def save(self, changed_items, lock, stamp):
+        """Save the cached workbook and bump the write counter.
+
+        The cache is dropped if the save fails.
+        """
+        try:
+            changed_rows = {
+                self.row_index[barcode]
+                for barcode in changed_items
+                if barcode in self.row_index
+            }
+            self.excel_handler.save_workbook(self.wb, changed_items, changed_rows)
+            lock.write_version(stamp)
+        except Exception:
+            self.wb = None
+            raise
+        self.wb_version = (stamp, self.excel_handler.get_file_version())
+
+    @timed("storage.find_item")
+    def find_item(self, barcode):
+        self.excel_handler.ensure_current_month()
+        index = self.excel_handler.get_item_index()
+        with self.excel_handler.lock:
+            item = index.get(str(barcode))
+            if item is not None:
+                return dict(item)
+        return None
+
+    @timed("storage.get_items")
+    def get_items(self):
+        self.excel_handler.ensure_current_month()
+        # Writes add to the index in place; callers iterate their own copy
+        index = self.excel_handler.get_item_index()
+        with self.excel_handler.lock:
+            return index.copy()
+
+    @timed("storage.upsert_items")
+    def upsert_items(self, items, add_quantity=False):
+        self.excel_handler.ensure_current_month()
+
+        def apply_changes(ws):
+            columns = self.columns
+            changed_items = {}
+
+            for item in items:
+                barcode = item["Barcode"]
+                values = {name: item[name] for name in ITEM_FIELDS}
+
+                target_row = self.row_index.get(barcode)
+                if target_row is None:
+                    target_row = self.take_free_row()
+                    self.row_index[barcode] = target_row
+                    # New files only carry formulas for the first 100 rows
+                    if ws[f"I{target_row}"].value is None:
+                        self.excel_handler.write_formulas(ws, target_row)
+                elif add_quantity:
+                    current = ws.cell(
+                        row=target_row, column=columns["Inventory Quantity"]
+                    ).value
+                    try:
+                        values["Inventory Quantity"] += int(current)
+                    except (ValueError, TypeError):
+                        pass
+
+                if "Quantity Left" in columns:
+                    # Kept equal to the stock, like apply_sale does
+                    values["Quantity Left"] = values["Inventory Quantity"]
+                for column_name, value in values.items():
+                    cell = ws.cell(
+                        row=target_row, column=columns[column_name], value=value
+                    )
+                    self.excel_handler.apply_formatting(cell, column_name)
+                changed_items[barcode] = values
+            return changed_items
+
+        self.write(apply_changes)
+
+    def applied_batches(self):
+        """Journal batches already applied to the cached workbook."""
+        props = self.wb.custom_doc_props
+        if APPLIED_BATCHES not in props.names:
+            return []
+        return (props[APPLIED_BATCHES].value or "").split()
+
+    def set_applied_batches(self, batches):
+        from openpyxl.packaging.custom import StringProperty
+
+        props = self.wb.custom_doc_props
+        value = " ".join(batches[-KEEP_BATCHES:])
+        if APPLIED_BATCHES in props.names:
+            props[APPLIED_BATCHES].value = value
+        else:
+            props.append(StringProperty(name=APPLIED_BATCHES, value=value))
+
+    @timed("storage.apply_sale")
+    def apply_sale(self, cart, batch=None):
+        if not cart:
+            return True
+        skipped = False
+
+        def apply_changes(ws):
+            nonlocal skipped
+            applied = self.applied_batches()
+            if batch in applied:
+                skipped = True
+                return None
+            columns = self.columns
+            changed_items = {}
+
+            for barcode, quantity in cart.items():
+                barcode = str(barcode)
+                # The row map is kept current by loads and upserts, so each
+                # sold barcode touches exactly one row
+                row = self.row_index.get(barcode)
+                if row is None:
+                    continue
+                inventory_cell = ws.cell(row=row, column=columns["Inventory Quantity"])
+                try:
+                    current_quantity = int(inventory_cell.value)
+                except (ValueError, TypeError):
+                    current_quantity = 0
+                inventory_cell.value = max(0, current_quantity - quantity)
+                changed = changed_items[barcode] = {
+                    "Inventory Quantity": inventory_cell.value
+                }
+
+                if "Quantity Sold" in columns:
+                    sold_cell = ws.cell(row=row, column=columns["Quantity Sold"])
+                    try:
+                        sold_quantity = int(sold_cell.value)
+                    except (ValueError, TypeError):
+                        sold_quantity = 0
+                    sold_cell.value = sold_quantity + quantity
+                    changed["Quantity Sold"] = sold_cell.value
+                if "Quantity Left" in columns:
+                    ws.cell(row=row, column=columns["Quantity Left"]).value = (
+                        inventory_cell.value
+                    )
+                    changed["Quantity Left"] = inventory_cell.value
+            if changed_items and batch is not None:
+                # Saved with the stock, so the two cannot disagree after a crash
+                self.set_applied_batches(applied + [batch])
+            return changed_items
+
+        self.write(apply_changes)
+        return not skipped
+
+    def close(self):
+        # Lets the next start skip parsing the workbook
+        self.excel_handler.save_item_cache()
+
+    @timed("storage.export_excel")
+    def export_excel(self, path=None):
+        # The workbook already is the export
+        if path and os.path.abspath(path) != os.path.abspath(
+            self.excel_handler.file_path
+        ):
+            with FileLock(self.get_lock_path()):
+                self.excel_handler.load_workbook().save(path)
+
+
+class SQLiteStorage(Storage):
+    """Inventory kept in an SQLite file; the workbook is exported on demand."""
+
+    def __init__(self, excel_handler):
+        self.excel_handler = excel_handler
+        self.lock = threading.Lock()
+        self.open()
+
+    def open(self):
+        """Open (and on first use seed) the database for the current month."""
+        excel_handler = self.excel_handler
+        self.last_excel_path = excel_handler.file_path
+        self.db_path = os.path.splitext(excel_handler.file_path)[0] + ".sqlite3"
+
+        is_new = not os.path.exists(self.db_path)
+        # The compactor thread writes through the same connection
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.create_tables()
+        if is_new:
+            self.import_excel(excel_handler.file_path)
+
+    def create_tables(self):
+        with self.conn:
+            self.conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS items (
+                    no INTEGER PRIMARY KEY,
+                    barcode TEXT NOT NULL UNIQUE,
+                    item_name TEXT,
+                    inventory_quantity INTEGER NOT NULL DEFAULT 0,
+                    quantity_sold INTEGER NOT NULL DEFAULT 0,
+                    quantity_left INTEGER,
+                    original_price REAL,
+                    sale_price REAL
+                )
+                """
+            )
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS applied_batches (batch TEXT PRIMARY KEY)"
+            )
+
+    def row_to_item(self, row):
+        return {
+            "No": row["no"],
+            "Barcode": row["barcode"],
+            "Item Name": row["item_name"],
+            "Inventory Quantity": row["inventory_quantity"],
+            "Quantity Sold": row["quantity_sold"],
+            "Quantity Left": row["quantity_left"],
+            "Original Price": row["original_price"],
+            "Sale Price": row["sale_price"],
+        }
+
+    @timed("storage.find_item")
+    def find_item(self, barcode):
+        self.excel_handler.ensure_current_month()
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT * FROM items WHERE barcode = ?", (str(barcode),)
+            ).fetchone()
+        return self.row_to_item(row) if row else None
+
+    @timed("storage.get_items")
+    def get_items(self):
+        self.excel_handler.ensure_current_month()
+        with self.lock:
+            rows = self.conn.execute("SELECT * FROM items ORDER BY no").fetchall()
+        return {row["barcode"]: self.row_to_item(row) for row in rows}
+
+    @timed("storage.upsert_items")
+    def upsert_items(self, items, add_quantity=False):
+        self.excel_handler.ensure_current_month()
+        if add_quantity:
+            quantity = "inventory_quantity + excluded.inventory_quantity"
+        else:
+            quantity = "excluded.inventory_quantity"
+
+        with self.lock, self.conn:
+            self.conn.executemany(
+                f"""
+                INSERT INTO items (
+                    barcode, item_name, inventory_quantity, original_price,
+                    sale_price, quantity_left
+                )
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(barcode) DO UPDATE SET
+                    item_name = excluded.item_name,
+                    inventory_quantity = {quantity},
+                    quantity_left = {quantity},
+                    original_price = excluded.original_price,
+                    sale_price = excluded.sale_price
+                """,
+                [
+                    [item[field] for field in ITEM_FIELDS]
+                    + [item["Inventory Quantity"]]
+                    for item in items
+                ],
+            )
+            changes = self.read_stock(item["Barcode"] for item in items)
+        if changes:
+            self.excel_handler.notify_stock(changes)
+
+    @timed("storage.apply_sale")
+    def apply_sale(self, cart, batch=None):
+        if not cart:
+            return True
+
+        with self.lock, self.conn:
+            if batch is not None:
+                cursor = self.conn.execute(
+                    "INSERT OR IGNORE INTO applied_batches (batch) VALUES (?)",
+                    (batch,),
+                )
+                if cursor.rowcount == 0:
+                    return False
+                self.conn.execute(
+                    "DELETE FROM applied_batches WHERE rowid <= "
+                    "(SELECT MAX(rowid) FROM applied_batches) - ?",
+                    (KEEP_BATCHES,),
+                )
+            self.conn.executemany(
+                """
+                UPDATE items SET
+                    inventory_quantity = MAX(0, inventory_quantity - :qty),
+                    quantity_sold = quantity_sold + :qty,
+                    quantity_left = MAX(0, inventory_quantity - :qty)
+                WHERE barcode = :barcode
+                """,
+                [
+                    {"barcode": str(barcode), "qty": int(qty)}
+                    for barcode, qty in cart.items()
+                ],
+            )
+            changes = self.read_stock(cart)
+        if changes:
+            self.excel_handler.notify_stock(changes)
+        return True
+
+    def read_stock(self, barcodes):
+        """{barcode: inventory quantity} for the barcodes that exist."""
+        barcodes = [str(barcode) for barcode in barcodes]
+        stock = {}
+        # Stay under SQLite's limit on query parameters
+        for start in range(0, len(barcodes), 500):
+            chunk = barcodes[start : start + 500]
+            rows = self.conn.execute(
+                "SELECT barcode, inventory_quantity FROM items "
+                f"WHERE barcode IN ({', '.join('?' * len(chunk))})",
+                chunk,
+            )
+            stock.update((row["barcode"], row["inventory_quantity"]) for row in rows)
+        return stock
+
+    def import_excel(self, path):
+        """Load every item row of a workbook in the ExcelHandler layout."""
+        if not os.path.exists(path):
+            return
+
+        from openpyxl import load_workbook
+
+        ws = load_workbook(path, read_only=True).active
+        header_row = next(ws.iter_rows(min_row=1, max_row=1, values_only=True))
+        headers = {name: i for i, name in enumerate(header_row) if name}
+
+        def value(row, name, default=None):
+            i = headers.get(name)
+            if i is None or i >= len(row) or row[i] is None:
+                return default
+            # Formula cells have no cached value we could trust
+            if isinstance(row[i], str) and row[i].startswith("="):
+                return default
+            return row[i]
+
+        items = []
+        for row in ws.iter_rows(min_row=2, values_only=True):
+            barcode = value(row, "Barcode")
+            if barcode is None:
+                continue
+            items.append(
+                (
+                    str(barcode),
+                    value(row, "Item Name"),
+                    int(value(row, "Inventory Quantity", 0) or 0),
+                    int(value(row, "Quantity Sold", 0) or 0),
+                    value(row, "Quantity Left"),
+                    value(row, "Original Price"),
+                    value(row, "Sale Price"),
+                )
+            )
+
+        with self.lock, self.conn:
+            self.conn.executemany(
+                """
+                INSERT OR IGNORE INTO items (
+                    barcode, item_name, inventory_quantity, quantity_sold,
+                    quantity_left, original_price, sale_price
+                )
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                items,
+            )
+
+    @timed("storage.export_excel")
+    def export_excel(self, path=None):
+        wb = self.excel_handler.new_workbook()
+        ws = wb.active
+
+        for row, item in enumerate(self.get_items().values(), start=2):
+            values = [row - 1] + [item[name] for name in HEADERS[1:8]]
+            for column, value in enumerate(values, start=1):
+                cell = ws.cell(row=row, column=column, value=value)
+                self.excel_handler.apply_formatting(cell, HEADERS[column - 1])
+            self.excel_handler.write_formulas(ws, row)
+
+        path = path or self.excel_handler.file_path
+        # Keep workbook writers in other processes out while the file is replaced
+        with FileLock(path + ".lock") as lock:
+            wb.save(path)
+            lock.write_version(lock.read_version() + 1)
+            self.excel_handler.take_snapshot(wb, path)
+
+    def switch_file(self):
+        # Leave last month's workbook up to date, then open the new month
+        self.close(path=self.last_excel_path)
+        self.open()
+
+    def close(self, path=None):
+        self.export_excel(path)
+        with self.lock:
+            self.conn.close()
+
+
+if __name__ == "__main__":
+    # python storage.py export [path] | import <path>
+    from excel import ExcelHandler
+
+    os.environ["POS_STORAGE"] = "sqlite"
+    storage = ExcelHandler().storage
+    command = sys.argv[1] if len(sys.argv) > 1 else "export"
+    if command == "export":
+        storage.export_excel(sys.argv[2] if len(sys.argv) > 2 else None)
+    elif command == "import":
+        storage.import_excel(sys.argv[2])
+    else:
+        print(f"Unknown command: {command}")
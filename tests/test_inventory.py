@@ -0,0 +1,47 @@
+import unittest
+import pandas as pd
+from inventory import validate_import_rows, validate_item
+
+FIELDS = ["Barcode", "Item Name", "Original Price", "Sale Price", "Inventory Quantity"]
+
+# As read from a supplier file, or typed into the inventory tab
+ROWS = [
+    ["4780022250220", "Kurt Ermak", "2000", "3000", "10"],
+    [" WL0047968 ", "Harry Potter", "15000.5", "20000", "3.0"],
+    ["8801043015080", "", "900", "1200", " 7 "],
+    ["", "No barcode", "1000", "1500", "1"],
+    ["8801062628520", "Bad cost", "abc", "1500", "1"],
+    ["8801062628521", "Blank price", "1000", "", "1"],
+    ["8801062628522", "NaN price", "1000", "nan", "1"],
+    ["8801062628523", "Infinite price", "inf", "1500", "1"],
+    ["8801062628524", "Negative infinite", "1000", "-inf", "1"],
+    ["8801062628525", "Half item", "1000", "1500", "2.5"],
+    ["8801062628526", "Infinite stock", "1000", "1500", "inf"],
+    ["8801062628527", "Words", "1000", "1500", "ten"],
+]
+
+
+class ValidationTest(unittest.TestCase):
+    def test_typed_and_imported_rows_agree(self):
+        valid, rejected = validate_import_rows(pd.DataFrame(ROWS, columns=FIELDS))
+        reasons = {record["row"]: record["reason"] for record in rejected}
+        for row, fields in enumerate(ROWS):
+            with self.subTest(row=fields):
+                try:
+                    item = validate_item(*fields)
+                except ValueError as e:
+                    self.assertEqual(reasons.get(row), str(e))
+                    continue
+                self.assertNotIn(row, reasons)
+                imported = valid.loc[row]
+                for field in FIELDS:
+                    self.assertEqual(imported[field], item[field])
+
+    def test_quantity_is_an_integer(self):
+        item = validate_item("4780022250220", "Kurt Ermak", "2000", "3000", "3.0")
+        self.assertEqual(item["Inventory Quantity"], 3)
+        self.assertIsInstance(item["Inventory Quantity"], int)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,143 @@
+import glob
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+from excel import ExcelHandler
+from locks import FileLock
+from journal import JournalCompactor, SalesJournal, make_sale_records
+
+BARCODE = "4780022250220"
+ITEM = {
+    "Barcode": BARCODE,
+    "Item Name": "Kurt Ermak",
+    "Inventory Quantity": 100,
+    "Original Price": 2000.0,
+    "Sale Price": 3000.0,
+}
+
+
+def sell_and_compact(path, sales):
+    """Till process: journal each sale and compact right after it."""
+    excel_handler = ExcelHandler(path)
+    journal = SalesJournal(excel_handler)
+    compactor = JournalCompactor(journal, excel_handler.storage.apply_sale)
+    for _ in range(sales):
+        journal.append(make_sale_records({BARCODE: 1}, {BARCODE: 3000.0}))
+        compactor.compact()
+    excel_handler.storage.close()
+
+
+class JournalCompactionTest(unittest.TestCase):
+    environ = {"POS_SNAPSHOTS": "0", "POS_STORAGE": "excel"}
+
+    def setUp(self):
+        patcher = mock.patch.dict(os.environ, self.environ)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        self.path = os.path.join(self.folder, "POS_2025_03.xlsx")
+        self.excel_handler = self.open_handler()
+        self.excel_handler.storage.upsert_item(ITEM)
+        self.journal = SalesJournal(self.excel_handler)
+
+    def open_handler(self):
+        excel_handler = ExcelHandler(self.path)
+        self.addCleanup(excel_handler.storage.close)
+        return excel_handler
+
+    def sell(self, quantity):
+        self.journal.append(make_sale_records({BARCODE: quantity}, {}))
+
+    def compact(self):
+        """Compact as the next start of the app would."""
+        excel_handler = self.open_handler()
+        journal = SalesJournal(excel_handler)
+        JournalCompactor(journal, excel_handler.storage.apply_sale).compact()
+        return excel_handler.storage.find_item(BARCODE)["Inventory Quantity"]
+
+    def archived(self):
+        with open(self.journal.get_archive_path(), encoding="utf-8") as f:
+            return [json.loads(line) for line in f]
+
+    def leftovers(self):
+        return glob.glob(os.path.join(self.folder, "*.compacting"))
+
+    def test_leftover_batch_is_applied_once(self):
+        self.sell(2)
+        # Claimed, then the app died before applying it
+        path = self.journal.begin_compaction()
+        self.assertEqual(self.compact(), 98)
+        self.assertEqual(self.compact(), 98)
+        self.assertEqual(self.leftovers(), [])
+        self.assertEqual(
+            [record["batch"] for record in self.archived()],
+            [self.journal.get_batch(path)],
+        )
+
+    def test_applied_batch_is_skipped(self):
+        self.sell(2)
+        path = self.journal.begin_compaction()
+        batch = self.journal.get_batch(path)
+        # Applied, then the app died before archiving it
+        self.assertTrue(self.excel_handler.storage.apply_sale({BARCODE: 2}, batch))
+        self.assertFalse(self.excel_handler.storage.apply_sale({BARCODE: 2}, batch))
+        self.assertEqual(self.compact(), 98)
+        self.assertEqual(len(self.archived()), 1)
+
+    def test_archived_batch_is_not_archived_again(self):
+        self.sell(2)
+        path = self.journal.begin_compaction()
+        compactor = JournalCompactor(
+            self.journal, self.excel_handler.storage.apply_sale
+        )
+        # Applied and archived, then the app died before removing the batch
+        compactor.apply_batch(path)
+        self.assertEqual(self.compact(), 98)
+        self.assertEqual(len(self.archived()), 1)
+        self.assertEqual(self.leftovers(), [])
+
+    def test_batch_waits_for_append(self):
+        self.sell(1)
+        journal_path = self.journal.get_journal_path()
+        claimed = []
+        # Another till is in the middle of an append
+        with FileLock(self.journal.get_lock_path(journal_path)):
+            with open(journal_path, "a", encoding="utf-8") as f:
+                claim = threading.Thread(
+                    target=lambda: claimed.append(self.journal.begin_compaction())
+                )
+                claim.start()
+                claim.join(0.3)
+                self.assertEqual(claimed, [])
+                f.write(json.dumps(make_sale_records({BARCODE: 2}, {})[0]) + "\n")
+        claim.join()
+        records = self.journal.read_records(claimed[0])
+        self.assertEqual([record["qty"] for record in records], [1, 2])
+
+    def test_tills_compacting_at_once(self):
+        tills = [
+            multiprocessing.Process(target=sell_and_compact, args=(self.path, 10))
+            for _ in range(2)
+        ]
+        for till in tills:
+            till.start()
+        for till in tills:
+            till.join()
+        self.assertEqual([till.exitcode for till in tills], [0, 0])
+        self.assertEqual(self.compact(), 80)
+        self.assertEqual(len(self.archived()), 20)
+        self.assertEqual(self.leftovers(), [])
+
+
+class SQLiteJournalCompactionTest(JournalCompactionTest):
+    environ = {"POS_SNAPSHOTS": "0", "POS_STORAGE": "sqlite"}
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+import json
+import socket
+import threading
+import time
+import unittest
+from service import FakeInventoryService, InventoryClient
+
+ITEMS = [
+    {
+        "Barcode": "4780022250220",
+        "Item Name": "Kurt Ermak",
+        "Inventory Quantity": 10,
+        "Original Price": 2000.0,
+        "Sale Price": 3000.0,
+    }
+]
+
+
+class InventoryServiceTest(unittest.TestCase):
+    def setUp(self):
+        self.service = FakeInventoryService(ITEMS)
+        self.host, self.port = self.service.start()
+        self.client = InventoryClient(self.host, self.port, timeout=0.5)
+
+    def tearDown(self):
+        self.client.close()
+        self.service.stop()
+
+    def stock(self):
+        return self.client.find_item_by_barcode("4780022250220")["Inventory Quantity"]
+
+    def test_sale_through_client(self):
+        self.client.record_sale({"4780022250220": 2})
+        self.assertEqual(self.stock(), 8)
+        self.assertEqual(self.service.backend.sales, [{"4780022250220": 2}])
+
+    def test_errors_are_raised_on_the_till(self):
+        with self.assertRaises(ValueError):
+            self.client.record_business_sale({"4780022250220": 50}, "Cafe Nur")
+        self.assertEqual(self.stock(), 10)
+
+    def test_resent_write_runs_once(self):
+        request = {
+            "id": 1,
+            "op": "commit_sale",
+            "args": [{"4780022250220": 2}],
+            "key": "sale-1",
+        }
+        for _ in range(2):
+            with socket.create_connection((self.host, self.port)) as sock:
+                sock.sendall(json.dumps(request).encode() + b"\n")
+                with sock.makefile("rb") as reader:
+                    self.assertTrue(json.loads(reader.readline())["ok"])
+        self.assertEqual(self.stock(), 8)
+
+    def test_writes_outlast_the_read_timeout(self):
+        ops = self.service.service.ops
+        commit_sale = ops["commit_sale"]
+
+        def slow_commit_sale(cart):
+            time.sleep(1.0)
+            commit_sale(cart)
+
+        ops["commit_sale"] = slow_commit_sale
+        self.client.commit_sale({"4780022250220": 1})
+        self.assertEqual(self.stock(), 9)
+
+    def test_reads_do_not_wait_for_writes(self):
+        ops = self.service.service.ops
+        commit_sale = ops["commit_sale"]
+        started = threading.Event()
+
+        def slow_commit_sale(cart):
+            started.set()
+            time.sleep(1.0)
+            commit_sale(cart)
+
+        ops["commit_sale"] = slow_commit_sale
+        write = threading.Thread(
+            target=self.client.commit_sale, args=({"4780022250220": 1},)
+        )
+        write.start()
+        self.assertTrue(started.wait(5))
+        begin = time.monotonic()
+        self.assertEqual(self.stock(), 10)
+        self.assertLess(time.monotonic() - begin, 0.5)
+        self.assertTrue(write.is_alive())
+        write.join()
+        self.assertEqual(self.stock(), 9)
+
+
+if __name__ == "__main__":
+    unittest.main()